@@ -0,0 +1,83 @@
+// Clientside callbacks for main.py. Slider frames come from the "forecast-frames" and "dose-frames" stores (see dashboard.encode_frames).
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    forecast: {
+        decoded: {}, // Per layer and level of detail {source, frames}
+        ids: [],
+        zoom: null,
+        level: null,
+        layer: null,
+
+        decode: function(frames, layer, level) {
+            // Decode the base64 uint16 payload of a level once, later slider moves reuse it
+            const z = frames.levels[level].z;
+            const key = layer + level;
+            if (!this.decoded[key] || this.decoded[key].source !== z) {
+                const binary = atob(z);
+                const bytes = new Uint8Array(binary.length);
+                for (let i = 0; i < binary.length; i++) {
+                    bytes[i] = binary.charCodeAt(i);
+                }
+                this.decoded[key] = {source: z, frames: new Uint16Array(bytes.buffer)};
+            }
+            return this.decoded[key].frames;
+        },
+
+        frame: function(frames, layer, level, leadtime) {
+            const cells = frames.levels[level].cells;
+            const quantized = this.decode(frames, layer, level).subarray(leadtime * cells, (leadtime + 1) * cells);
+            const z = new Array(cells);
+            for (let i = 0; i < cells; i++) {
+                z[i] = quantized[i] === 65535 ? null : frames.offset + quantized[i] * frames.scale;
+            }
+            return z;
+        },
+
+        locations: function(cells) {
+            // Feature k of every level has the id "k", so locations are not sent
+            for (let i = this.ids.length; i < cells; i++) {
+                this.ids.push(String(i));
+            }
+            return this.ids.slice(0, cells);
+        },
+
+        level_for_zoom: function(frames, zoom) {
+            // Finest level whose min_zoom is reached, see lod.level_for_zoom
+            for (let i = 0; i < frames.levels.length; i++) {
+                if (zoom >= frames.levels[i].min_zoom) return i;
+            }
+            return frames.levels.length - 1;
+        },
+
+        update_figures: function(leadtime, relayout, layer, concentration_frames, dose_frames, map_figure, chart_figure) {
+            const forecast = window.dash_clientside.forecast;
+            const frames = layer === "Dose" ? dose_frames : concentration_frames;
+            if (relayout && relayout["map.zoom"] !== undefined) {
+                forecast.zoom = relayout["map.zoom"];
+            } else if (forecast.zoom === null) {
+                forecast.zoom = map_figure.layout.map.zoom;
+            }
+            const level = forecast.level_for_zoom(frames, forecast.zoom);
+            const triggered = dash_clientside.callback_context.triggered.map(t => t.prop_id);
+            if (triggered.length && triggered.every(id => id === "map.relayoutData") && level === forecast.level && layer === forecast.layer) {
+                // Panned or zoomed within the same level of detail
+                return [dash_clientside.no_update, dash_clientside.no_update];
+            }
+            forecast.level = level;
+            forecast.layer = layer;
+
+            const map = Object.assign({}, map_figure, {
+                data: [Object.assign({}, map_figure.data[0], {
+                    geojson: frames.levels[level].geojson,
+                    locations: forecast.locations(frames.levels[level].cells),
+                    z: forecast.frame(frames, layer, level, leadtime),
+                    zmin: frames.zrange[0],
+                    zmax: frames.zrange[1]
+                })]
+            });
+            const chart = Object.assign({}, chart_figure, {
+                data: [Object.assign({}, chart_figure.data[0], {y: frames.cumulative_exposure.slice(0, leadtime + 1)})]
+            });
+            return [map, chart];
+        }
+    }
+});
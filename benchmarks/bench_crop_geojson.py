@@ -0,0 +1,25 @@
+import json
+
+import crop_geojson
+from bench_geodata import CITY_LIMITS
+
+
+def drop_index():
+    crop_geojson._indexes.clear()
+    crop_geojson.index_path_for(crop_geojson.EUROPE_GEOJSON_PATH).unlink(missing_ok=True)
+
+
+def bench_build_geojson_index(bench):
+    bench("build_geojson_index", lambda: crop_geojson.load_geojson_index(), setup=drop_index)
+
+
+def bench_crop_geojson_indexed(bench):
+    crop_geojson.load_geojson_index()
+    bench("crop_geojson city indexed", lambda: crop_geojson.crop_geojson(CITY_LIMITS))
+
+
+def bench_crop_geojson_loaded(bench):
+    def crop():
+        with open(crop_geojson.EUROPE_GEOJSON_PATH, "r") as file:
+            crop_geojson.crop_geojson(CITY_LIMITS, json.load(file))
+    bench("crop_geojson city json.load + scan", crop)
@@ -0,0 +1,51 @@
+import json
+import gzip
+
+import dashboard
+import geodata
+import crop_geojson
+import lod
+from bench_geodata import CITY_LIMITS, query
+
+
+def forecast(request):
+    return geodata.query_forecast_nc(query(list(range(request.config.getoption("leadtimes")))), as_array=True)
+
+
+def bench_create_map_figure(bench, request):
+    geojson = crop_geojson.crop_geojson(CITY_LIMITS)
+    data = forecast(request)
+    locations = geodata.grid_ids(data["lon"].values, data["lat"].values).ravel().tolist()
+    bench("create_map_figure + to_json", lambda: dashboard.create_map_figure(geojson, locations, data.values[0].ravel()).to_json())
+
+
+def bench_build_lod(bench, request):
+    geojson = crop_geojson.crop_geojson(CITY_LIMITS)
+    data = forecast(request)
+    bench("build_lod", lambda: lod.build_lod(geojson, data))
+
+
+def bench_encode_frames(bench, request):
+    data = forecast(request)
+    levels = lod.build_lod(crop_geojson.crop_geojson(CITY_LIMITS), data)
+    bench("encode_frames", lambda: dashboard.encode_frames(levels, [0.0] * len(data["leadtime"])))
+
+
+def bench_payload(bench, request):
+    """Bytes the browser downloads: the page's figures and frames, and the GeoJSON of each level of detail.
+    "inline" is the map figure with the whole GeoJSON, locations and values embedded."""
+    geojson = crop_geojson.crop_geojson(CITY_LIMITS)
+    data = forecast(request)
+    locations = geodata.grid_ids(data["lon"].values, data["lat"].values).ravel().tolist()
+    inline = dashboard.create_map_figure(geojson, locations, data.values[0].ravel()).to_json()
+    bench("payload map figure inline", lambda: inline.encode(), payload_bytes=len(inline.encode()))
+
+    levels = lod.build_lod(geojson, data)
+    level = lod.level_for_zoom(levels, dashboard.MAP_ZOOM)
+    page = lambda: json.dumps({
+        "map": json.loads(dashboard.create_map_figure(dashboard.GEOJSON_URL.format(level=level, etag=levels[level].etag), [], []).to_json()),
+        "frames": dashboard.encode_frames(levels, [0.0] * len(data["leadtime"]))
+    }).encode()
+    bench("payload page figure + frames", page, payload_bytes=len(page()))
+    for position, current in enumerate(levels):
+        bench(f"payload geojson level {position} gzip", lambda: gzip.decompress(current.geojson), payload_bytes=len(current.geojson))
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fleet
+import synthetic
+from bench_geodata import clear_caches
+from bench_pollution import RUN
+
+
+N_SITES = 20000
+
+
+def sites(n_sites:int, seed:int=0) -> pd.DataFrame:
+    """Buildings spread over the synthetic domain."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "lon": rng.uniform(synthetic.WEST + 1, synthetic.EAST - 1, n_sites),
+        "lat": rng.uniform(synthetic.SOUTH + 1, synthetic.NORTH - 1, n_sites),
+        "air_intake_litres_per_minute": rng.uniform(500, 5000, n_sites),
+        "filter_capacity": rng.uniform(1e5, 5e6, n_sites)
+    })
+
+
+@pytest.mark.parametrize("chunk_size", [1000, fleet.CHUNK_SIZE])
+def bench_predict_fleet(bench, chunk_size):
+    """Duration of N_SITES sites, sites per second is N_SITES / best_seconds."""
+    data = sites(N_SITES)
+    chunks = lambda: (data.iloc[start:start + chunk_size] for start in range(0, N_SITES, chunk_size))
+    bench(
+        f"predict_fleet {N_SITES} sites chunks of {chunk_size}",
+        lambda: sum(len(df) for df in fleet.predict_fleet(chunks(), "PM10", RUN, kind="serial")),
+        setup=clear_caches, sites=N_SITES, chunk_size=chunk_size
+    )
@@ -0,0 +1,88 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import geodata
+import synthetic
+from catalog import Catalog
+from geodata import ForecastMultiQuery, AnalysisQuery
+
+
+CITY_LIMITS = {"north": 54, "south": 44, "west": -4, "east": 8}
+
+
+def query(leadtimes:list[int], limits=CITY_LIMITS) -> ForecastMultiQuery:
+    return ForecastMultiQuery(variable="PM10", time=datetime(2025, 5, 10), leadtimes=leadtimes, model=None, limits=limits)
+
+
+def clear_caches():
+    geodata.close_datasets()
+    geodata.slice_cache.clear()
+
+
+def bench_query_forecast_nc_city_cold(bench):
+    bench("query_forecast_nc city cold", lambda: geodata.query_forecast_nc(query([0])), setup=clear_caches)
+
+
+def bench_query_forecast_nc_city_warm(bench):
+    geodata.query_forecast_nc(query([0]))
+    bench("query_forecast_nc city warm", lambda: geodata.query_forecast_nc(query([0])))
+
+
+def bench_query_forecast_nc_europe_cold(bench):
+    bench("query_forecast_nc europe cold", lambda: geodata.query_forecast_nc(query([0], limits=None)), setup=clear_caches)
+
+
+def bench_query_forecast_nc_array(bench, request):
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+    bench("query_forecast_nc as_array all leadtimes cold", lambda: geodata.query_forecast_nc(query(leadtimes), as_array=True), setup=clear_caches, leadtimes=len(leadtimes))
+
+
+def bench_get_dataframe(bench, request):
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+    bench("get_dataframe all leadtimes cold", lambda: geodata.get_dataframe(query(leadtimes)), setup=clear_caches, leadtimes=len(leadtimes))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def bench_query_forecast_europe_memory(bench, request, compact):
+    """Peak MiB compares the long-form frame with a CompactFrame of the same query."""
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+    name = "compact" if compact else "frame"
+    bench(f"query_forecast europe all leadtimes {name}", lambda: geodata.query_forecast(query(leadtimes, limits=None), compact=compact), setup=clear_caches, leadtimes=len(leadtimes))
+
+
+@pytest.mark.parametrize("kind", ["serial", "thread", "process"])
+def bench_query_forecasts(bench, request, kind):
+    """One query per leadtime stands in for a backfill over many runs."""
+    queries = [query([leadtime]) for leadtime in range(request.config.getoption("leadtimes"))]
+    workers = max(os.cpu_count() or 1, 2)
+
+    def cold_pool():
+        # NOTE: A fresh pool with geodata imported, so workers have cold caches and startup is not timed
+        clear_caches()
+        geodata.close_executors()
+        executor = geodata.read_executor(kind, workers)
+        if executor:
+            for future in [executor.submit(geodata.cache_stats) for _ in range(workers)]: future.result() # Imports geodata in each worker
+
+    bench(f"query_forecasts per leadtime {kind}", lambda: geodata.query_forecasts(queries, kind=kind, workers=workers), setup=cold_pool, leadtimes=len(queries), workers=workers)
+    geodata.close_executors()
+
+
+
+@pytest.mark.parametrize("days", [2, 8, 32])
+def bench_query_analysis_days(bench, data_dir, monkeypatch, days):
+    """One analysis file per day. Peak MiB and RSS +MiB should stay flat as days grow."""
+    n_lat, n_lon = map(int, data_dir["grid"].split("x"))
+    root = data_dir["dir"] / f"analysis{days}"
+    start = datetime(2025, 5, 1)
+    synthetic.write_analysis_days(root, start, days, n_lat, n_lon)
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(root / "data/netcdf")))
+    analysis = AnalysisQuery(variable="PM10", start_time=start, end_time=start + timedelta(days=days))
+
+    def run():
+        geodata.query_analysis(analysis, as_array=True)
+        assert geodata.cache_stats()["datasets_open"] == 0
+
+    bench(f"query_analysis {days} daily files", run, days=days)
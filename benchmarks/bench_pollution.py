@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import geodata
+import pollution
+from pollution import Coordinate
+from bench_geodata import query
+
+
+PARIS = Coordinate(lon=2.35, lat=48.85)
+RUN = datetime(2025, 5, 10)
+
+
+def forecast(request):
+    return geodata.query_forecast_nc(query(list(range(request.config.getoption("leadtimes")))), as_array=True)
+
+
+def bench_accumulation(bench, request):
+    data = forecast(request)
+    hours = len(data["leadtime"]) - 1
+    bench("accumulation one interval", lambda: pollution.accumulation(
+        data, PARIS, RUN + timedelta(minutes=30), RUN + timedelta(hours=hours),
+        air_intake_cubics_per_minute=1
+    ))
+
+
+def bench_accumulation_intervals(bench, request):
+    data = forecast(request)
+    hourly_values = pollution.location_series(data, PARIS)
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(0, len(hourly_values) / 2, 10_000)
+    ends = starts + rng.uniform(0, len(hourly_values) / 2, 10_000)
+    bench("accumulation_intervals 10k intervals", lambda: pollution.accumulation_intervals(
+        hourly_values, starts, ends, air_intake_litres_per_minute=500
+    ), intervals=10_000)
+
+
+def bench_exposure_map_europe(bench, request):
+    """Dose of every grid cell, compare with query_forecast_nc as_array all leadtimes cold."""
+    data = geodata.query_forecast_nc(query(list(range(request.config.getoption("leadtimes"))), limits=None), as_array=True)
+    hours = len(data["leadtime"]) - 1
+    bench("exposure_map europe", lambda: pollution.exposure_map(
+        data, RUN + timedelta(minutes=30), RUN + timedelta(hours=hours),
+        air_intake_cubics_per_minute=1
+    ), leadtimes=len(data["leadtime"]))
+
+
+def bench_exposure_map_intervals_europe(bench, request):
+    """Dose of every grid cell from run time until each leadtime, the dashboard's dose map layer."""
+    data = geodata.query_forecast_nc(query(list(range(request.config.getoption("leadtimes"))), limits=None), as_array=True)
+    leadtimes = data["leadtime"].values
+    bench("exposure_map_intervals europe per leadtime", lambda: pollution.exposure_map_intervals(
+        data, np.zeros(len(leadtimes)), leadtimes, air_intake_cubics_per_minute=1
+    ), leadtimes=len(leadtimes), intervals=len(leadtimes))
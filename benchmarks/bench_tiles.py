@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import crop_geojson
+import geodata
+import tiles
+from bench_geodata import CITY_LIMITS, clear_caches, query
+
+
+# A neighbouring city overlapping the tiles of CITY_LIMITS
+NEIGHBOUR_LIMITS = {"north": 53, "south": 45, "west": -2, "east": 10}
+
+
+def clear_tiles():
+    clear_caches()
+    tiles.tile_cache.clear()
+
+
+def bench_geojson_region_cold(bench):
+    crop_geojson.load_geojson_index()
+    bench("geojson_region city cold tiles", lambda: tiles.geojson_region(CITY_LIMITS), setup=clear_tiles)
+
+
+def bench_geojson_region_cold_direct(bench):
+    """Baseline of bench_geojson_region_cold, one indexed crop without tiles."""
+    crop_geojson.load_geojson_index()
+    bench("geojson_region city cold direct crop", lambda: crop_geojson.crop_geojson(CITY_LIMITS), setup=clear_tiles)
+
+
+def bench_geojson_region_neighbour(bench):
+    def warm_city():
+        clear_tiles()
+        tiles.geojson_region(CITY_LIMITS)
+    bench("geojson_region neighbour of cached city", lambda: tiles.geojson_region(NEIGHBOUR_LIMITS), setup=warm_city)
+
+
+def bench_forecast_region_neighbour(bench, request):
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+
+    def warm_city():
+        clear_tiles()
+        tiles.forecast_region("PM10", datetime(2025, 5, 10), leadtimes, CITY_LIMITS)
+    bench("forecast_region neighbour of cached city", lambda: tiles.forecast_region("PM10", datetime(2025, 5, 10), leadtimes, NEIGHBOUR_LIMITS), setup=warm_city, leadtimes=len(leadtimes))
+
+
+def bench_forecast_region_cold(bench, request):
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+    bench("forecast_region city cold tiles", lambda: tiles.forecast_region("PM10", datetime(2025, 5, 10), leadtimes, CITY_LIMITS), setup=clear_tiles, leadtimes=len(leadtimes))
+
+
+def bench_forecast_region_cold_direct(bench, request):
+    """Baseline of bench_forecast_region_cold, one query_forecast without tiles."""
+    leadtimes = list(range(request.config.getoption("leadtimes")))
+    bench("forecast_region city cold direct query", lambda: geodata.query_forecast(query(leadtimes), as_array=True), setup=clear_tiles, leadtimes=len(leadtimes))
@@ -0,0 +1,42 @@
+"""Compare two benchmark result files: python benchmarks/compare.py OLD.json NEW.json"""
+import sys
+import json
+
+
+def load(path:str) -> tuple[dict, dict]:
+    with open(path, "r") as file:
+        run = json.load(file)
+    return run, {(result["name"], result["grid"]): result for result in run["results"]}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    old_run, old = load(sys.argv[1])
+    new_run, new = load(sys.argv[2])
+    print(f"{old_run['commit']} -> {new_run['commit']}")
+    print(f"{'name':<46} {'grid':>10} {'old ms':>10} {'new ms':>10} {'speedup':>8} {'peak MiB':>16}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        print(
+            f"{key[0]:<46} {key[1]:>10} {before['best_seconds']*1000:>10.1f} {after['best_seconds']*1000:>10.1f} "
+            f"{before['best_seconds'] / after['best_seconds']:>7.2f}x "
+            f"{before['peak_bytes']/2**20:>7.1f}->{after['peak_bytes']/2**20:<7.1f}"
+        )
+    payloads = sorted(key for key in old.keys() & new.keys() if "payload_bytes" in old[key] and "payload_bytes" in new[key])
+    if payloads:
+        print(f"{'payload':<46} {'grid':>10} {'old KiB':>10} {'new KiB':>10}")
+        for key in payloads:
+            print(f"{key[0]:<46} {key[1]:>10} {old[key]['payload_bytes']/2**10:>10.1f} {new[key]['payload_bytes']/2**10:>10.1f}")
+    rss = sorted(key for key in old.keys() & new.keys() if old[key].get("rss_delta_bytes") is not None and new[key].get("rss_delta_bytes") is not None)
+    if rss:
+        print(f"{'RSS growth':<46} {'grid':>10} {'old MiB':>10} {'new MiB':>10} {'maxRSS +MiB':>16}")
+        for key in rss:
+            before, after = old[key], new[key]
+            print(
+                f"{key[0]:<46} {key[1]:>10} {before['rss_delta_bytes']/2**20:>10.1f} {after['rss_delta_bytes']/2**20:>10.1f} "
+                f"{before['maxrss_delta_bytes']/2**20:>7.1f}->{after['maxrss_delta_bytes']/2**20:<7.1f}"
+            )
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{key[0]:<46} {key[1]:>10} only in {'old' if key in old else 'new'}")
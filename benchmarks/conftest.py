@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import synthetic
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+_results: list[dict] = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--grids", default="105x175,210x350,420x700", help="Comma separated <lat>x<lon> grid sizes")
+    group.addoption("--leadtimes", type=int, default=13, help="Leadtimes in the synthetic forecast")
+    group.addoption("--features", type=int, default=None, help="GeoJSON features, defaults to one per grid cell")
+    group.addoption("--repeat", type=int, default=5, help="Timed runs per benchmark, the fastest is reported")
+    group.addoption("--results", default=None, help="Where to write the JSON results")
+
+
+def pytest_generate_tests(metafunc):
+    if "dataset" in metafunc.fixturenames:
+        grids = metafunc.config.getoption("grids").split(",")
+        metafunc.parametrize("dataset", grids, indirect=True, scope="session")
+
+
+@pytest.fixture(scope="session")
+def dataset(request, tmp_path_factory):
+    """Synthetic data directory for one grid size. Benchmarks run with it as working directory,
+    because the app reads data/... paths relative to it."""
+    n_lat, n_lon = map(int, request.param.split("x"))
+    n_features = request.config.getoption("features") or n_lat * n_lon
+    directory = tmp_path_factory.mktemp(f"grid{request.param}")
+    synthetic.write_dataset(directory, n_lat, n_lon, request.config.getoption("leadtimes"), n_features)
+    return {"dir": directory, "grid": request.param, "cells": n_lat * n_lon, "features": n_features}
+
+
+@pytest.fixture
+def data_dir(dataset, monkeypatch):
+    monkeypatch.chdir(dataset["dir"])
+    return dataset
+
+
+def _rss_bytes() -> int|None:
+    """Current resident set size, None where /proc is missing."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def _maxrss_bytes() -> int:
+    """Peak resident set size of the process so far, ru_maxrss is KiB on Linux and bytes on macOS."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+@pytest.fixture
+def bench(request, data_dir):
+    """bench(name, func, setup=None) times func, records the fastest of --repeat runs and the peak memory
+    of one extra traced run. setup runs untimed before every run, eg. to clear caches for a cold read.
+    tracemalloc misses memory allocated by C libraries (HDF5, netCDF) and mapped pages, so the first timed
+    run also records the growth of the resident set size and of its peak. NOTE: The peak only grows once a
+    benchmark exceeds every earlier one in the session, run a single benchmark with -k for its own peak."""
+    repeat = request.config.getoption("repeat")
+
+    def run(name:str, func, setup=None, **params):
+        timings = []
+        for position in range(repeat):
+            if setup: setup()
+            if position == 0:
+                rss, maxrss = _rss_bytes(), _maxrss_bytes()
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+            if position == 0:
+                rss_delta = _rss_bytes() - rss if rss is not None else None
+                maxrss_delta = _maxrss_bytes() - maxrss
+
+        if setup: setup()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        _results.append({
+            "name": name,
+            "grid": data_dir["grid"],
+            "cells": data_dir["cells"],
+            "features": data_dir["features"],
+            **params,
+            "best_seconds": min(timings),
+            "median_seconds": statistics.median(timings),
+            "peak_bytes": peak,
+            "rss_delta_bytes": rss_delta,
+            "maxrss_delta_bytes": maxrss_delta
+        })
+    return run
+
+
+def _git_commit() -> str|None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pytest_sessionfinish(session):
+    if not _results: return
+    commit = _git_commit()
+    path = session.config.getoption("results")
+    if path is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.now():%Y%m%dT%H%M%S}-{commit or 'nogit'}.json"
+    with open(path, "w") as file:
+        json.dump({
+            "commit": commit,
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "leadtimes": session.config.getoption("leadtimes"),
+            "results": _results
+        }, file, indent=2)
+    session.config._benchmark_results_path = path
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _results: return
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'name':<46} {'grid':>10} {'cells':>9} {'best ms':>10} {'median ms':>10} {'peak MiB':>9} {'RSS +MiB':>9} {'maxRSS +MiB':>12} {'payload KiB':>12}")
+    for result in sorted(_results, key=lambda result: (result["name"], result["cells"])):
+        payload = f"{result['payload_bytes']/2**10:.1f}" if "payload_bytes" in result else "-"
+        rss = f"{result['rss_delta_bytes']/2**20:.1f}" if result.get("rss_delta_bytes") is not None else "-"
+        terminalreporter.write_line(
+            f"{result['name']:<46} {result['grid']:>10} {result['cells']:>9} "
+            f"{result['best_seconds']*1000:>10.1f} {result['median_seconds']*1000:>10.1f} {result['peak_bytes']/2**20:>9.1f} {rss:>9} {result['maxrss_delta_bytes']/2**20:>12.1f} {payload:>12}"
+        )
+    path = getattr(config, "_benchmark_results_path", None)
+    if path:
+        terminalreporter.write_line(f"Results written to {path}, compare runs with: python benchmarks/compare.py OLD.json NEW.json")
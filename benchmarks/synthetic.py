@@ -0,0 +1,135 @@
+"""Synthetic CAMS-like inputs for the benchmarks, no CDS download needed.
+
+    python benchmarks/synthetic.py <target_dir> --grid 420x700 --leadtimes 97
+
+writes <target_dir>/data/netcdf/.../ENS_FORECAST.nc and <target_dir>/data/geojson/europe.forecast.geo.json
+at the paths the app reads by default."""
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import geodata
+import catalog
+import crop_geojson
+
+
+# CAMS Europe domain
+NORTH, SOUTH, WEST, EAST = 72.0, 30.0, -25.0, 45.0
+
+# Where the CDS download puts the forecast, the app finds it there with catalog.py
+FORECAST_NC_PATH = f"{catalog.NETCDF_DIR}/cams-europe-air-quality-forecasts/EU-forecast-PM10-2025-05-10-24/ENS_FORECAST.nc"
+
+
+def grid_axes(n_lat:int, n_lon:int) -> tuple[np.ndarray, np.ndarray]:
+    """Cell centers covering the CAMS Europe domain. Latitude descends and longitude uses 0..360 like CAMS files."""
+    lat_step = (NORTH - SOUTH) / n_lat
+    lon_step = (EAST - WEST) / n_lon
+    latitude = NORTH - lat_step * (np.arange(n_lat) + 0.5)
+    longitude = WEST + lon_step * (np.arange(n_lon) + 0.5)
+    return latitude.astype(np.float32), np.where(longitude < 0, longitude + 360, longitude).astype(np.float32)
+
+
+def write_forecast_nc(path:Path|str, n_lat:int, n_lon:int, n_leadtimes:int, variable:str="pm10_conc", seed:int=0, hours:list[float]=None) -> Path:
+    """Smooth pollution field drifting with leadtime plus noise, compressed and chunked per leadtime like CAMS.
+    The time axis is hours 0..n_leadtimes-1 unless hours are given."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    latitude, longitude = grid_axes(n_lat, n_lon)
+    rng = np.random.default_rng(seed)
+    lat_wave = np.sin(np.linspace(0, 3 * np.pi, n_lat))[:, np.newaxis]
+    lon_wave = np.cos(np.linspace(0, 5 * np.pi, n_lon))[np.newaxis, :]
+
+    values = np.empty((n_leadtimes, 1, n_lat, n_lon), dtype=np.float32)
+    for leadtime in range(n_leadtimes):
+        drift = np.roll(lat_wave * lon_wave, leadtime, axis=1)
+        values[leadtime, 0] = 12 + 8 * drift + rng.normal(0, 1.5, (n_lat, n_lon))
+
+    ds = xr.Dataset(
+        {variable: (("time", "level", "latitude", "longitude"), values)},
+        coords={
+            "time": np.arange(n_leadtimes, dtype=np.float64) if hours is None else np.asarray(hours, dtype=np.float64),
+            "level": np.array([0.0], dtype=np.float32),
+            "latitude": latitude,
+            "longitude": longitude
+        }
+    )
+    ds.to_netcdf(path, engine="netcdf4", encoding={
+        variable: {"zlib": True, "complevel": 4, "chunksizes": (1, 1, n_lat, n_lon)}
+    })
+    return path
+
+
+def write_analysis_days(target_dir:Path|str, start:datetime, days:int, n_lat:int, n_lon:int, variable:str="pm10_conc") -> list[Path]:
+    """One ENS_ANALYSIS.nc of 24 hourly grids per day from start, laid out like CAMS downloads under data/netcdf."""
+    paths = []
+    for day in range(days):
+        run = start + timedelta(days=day)
+        path = Path(target_dir) / catalog.NETCDF_DIR / "cams-europe-air-quality-forecasts" / f"EU-analysis-PM10-{run:%Y-%m-%d}-24" / "ENS_ANALYSIS.nc"
+        paths.append(write_forecast_nc(path, n_lat, n_lon, 24, variable, seed=day))
+    return paths
+
+
+def write_geojson(path:Path|str, n_features:int) -> Path:
+    """Square polygon per cell of a grid of about n_features cells over the same domain.
+    Ids and centroids are formatted like the forecast frames, "[lon, lat]" with 2 decimals."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Same aspect ratio as the domain
+    n_lat = max(1, round(np.sqrt(n_features * (NORTH - SOUTH) / (EAST - WEST))))
+    n_lon = max(1, round(n_features / n_lat))
+    latitude, longitude = grid_axes(n_lat, n_lon)
+    longitude = geodata.longitude_180(longitude)
+    half_lat = (NORTH - SOUTH) / n_lat / 2
+    half_lon = (EAST - WEST) / n_lon / 2
+
+    # NOTE: Written feature by feature so large files do not need to fit in memory
+    with open(path, "w") as file:
+        file.write('{"type": "FeatureCollection", "features": [')
+        first = True
+        for lat in geodata.rounded_axis(latitude).tolist():
+            for lon in geodata.rounded_axis(longitude).tolist():
+                corners = [
+                    [round(lon - half_lon, 4), round(lat - half_lat, 4)],
+                    [round(lon + half_lon, 4), round(lat - half_lat, 4)],
+                    [round(lon + half_lon, 4), round(lat + half_lat, 4)],
+                    [round(lon - half_lon, 4), round(lat + half_lat, 4)],
+                    [round(lon - half_lon, 4), round(lat - half_lat, 4)]
+                ]
+                feature = {
+                    "type": "Feature",
+                    "id": f"[{lon}, {lat}]",
+                    "geometry": {"type": "Polygon", "centroid": [lon, lat], "coordinates": [corners]}
+                }
+                file.write(("" if first else ", ") + json.dumps(feature))
+                first = False
+        file.write("]}")
+    return path
+
+
+def write_dataset(target_dir:Path|str, n_lat:int, n_lon:int, n_leadtimes:int, n_features:int) -> Path:
+    """Full synthetic data directory, laid out like the app's data/ folder."""
+    target_dir = Path(target_dir)
+    write_forecast_nc(target_dir / FORECAST_NC_PATH, n_lat, n_lon, n_leadtimes)
+    write_geojson(target_dir / crop_geojson.EUROPE_GEOJSON_PATH, n_features)
+    return target_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target_dir")
+    parser.add_argument("--grid", default="420x700", help="<lat>x<lon> cells, CAMS Europe is 420x700")
+    parser.add_argument("--leadtimes", type=int, default=97)
+    parser.add_argument("--features", type=int, default=None, help="GeoJSON features, defaults to one per grid cell")
+    args = parser.parse_args()
+
+    n_lat, n_lon = map(int, args.grid.split("x"))
+    write_dataset(args.target_dir, n_lat, n_lon, args.leadtimes, args.features or n_lat * n_lon)
+    print(f"Wrote synthetic dataset to {os.path.abspath(args.target_dir)}")
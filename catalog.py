@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+
+NETCDF_DIR = "data/netcdf"
+INDEX_NAME = "catalog.json"
+DEFAULT_MODEL = "ENS" # CAMS ensemble median, used when a query has no model
+
+# Query variable -> variable name inside CAMS NetCDF files. Variables missing here are looked up by their NetCDF name.
+NC_VARIABLES = {
+    "PM2.5": "pm2p5_conc",
+    "PM10": "pm10_conc",
+    "PM10 Dust": "dust",
+    "NH3": "nh3_conc",
+    "CO": "co_conc",
+    "NO2": "no2_conc",
+    "VOCs": "nmvoc_conc",
+    "O3": "o3_conc",
+    "SO2": "so2_conc",
+    "Alder pollen": "apg_conc",
+    "Birch pollen": "bpg_conc",
+    "Grass pollen": "gpg_conc",
+    "Mugwort pollen": "mpg_conc",
+    "Olive pollen": "olpg_conc",
+    "Ragweed pollen": "rwpg_conc"
+}
+QUERY_VARIABLES = {nc_variable: variable for variable, nc_variable in NC_VARIABLES.items()}
+
+# Held while this process is inside the NetCDF library: opening, decoding or closing files. A fork waits for it, so
+# no child (gunicorn worker) inherits HDF5 halfway through a call. Reentrant, geodata decodes under it too.
+netcdf_lock = threading.RLock()
+os.register_at_fork(before=netcdf_lock.acquire, after_in_parent=netcdf_lock.release, after_in_child=netcdf_lock.release)
+
+
+@dataclass
+class CatalogEntry:
+    variable: str # Query variable, eg. PM10
+    nc_variable: str # Variable inside the file, eg. pm10_conc
+    run: datetime
+    model: str
+    path: str
+    kind: str = "forecast" # or "analysis"
+    hours: tuple[int, int] = (0, 0) # First and last hour of the time axis since run
+    leadtimes: tuple[int, ...] = () # Every hour of the time axis, which may not start at 0 or may have gaps
+
+
+def run_from_path(nc_path:str) -> datetime:
+    """CAMS downloads are stored as .../EU-forecast-<variable>-YYYY-MM-DD-<hours>/<MODEL>_FORECAST.nc"""
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", str(nc_path))
+    if not match:
+        raise ValueError(f"Can not read run date from {nc_path=}")
+    return datetime.strptime(match.group(1), "%Y-%m-%d")
+
+
+def model_from_path(nc_path:str) -> str:
+    """ENS_FORECAST.nc -> ENS, CHIMERE_FORECAST.nc -> CHIMERE"""
+    return Path(nc_path).stem.split("_")[0].upper()
+
+
+def kind_from_path(nc_path:str) -> str:
+    """ENS_ANALYSIS.nc -> analysis, ENS_FORECAST.nc -> forecast"""
+    return "analysis" if "ANALYSIS" in Path(nc_path).stem.upper() else "forecast"
+
+
+def time_hours(time:np.ndarray) -> np.ndarray:
+    """Hours since the first step of a CAMS time axis, which is either datetimes or float hours."""
+    if np.issubdtype(time.dtype, np.datetime64):
+        return (time - time[0]) // np.timedelta64(1, "h")
+    return np.rint(time).astype(np.int64)
+
+
+def scan_file(nc_path:str) -> dict:
+    """Index record of one file. Only the header is read, no values are decoded."""
+    with netcdf_lock, xr.open_dataset(nc_path, engine="netcdf4", decode_timedelta=False) as ds:
+        nc_variables = [
+            name for name, data in ds.data_vars.items()
+            if {"time", "latitude", "longitude"}.issubset(data.dims)
+        ]
+        hours = time_hours(ds.variables["time"].values)
+    return {
+        "run": run_from_path(nc_path).isoformat(),
+        "model": model_from_path(nc_path),
+        "kind": kind_from_path(nc_path),
+        "hours": [int(hours[0]), int(hours[-1])] if len(hours) else [0, 0],
+        "leadtimes": hours.tolist(),
+        "variables": {QUERY_VARIABLES.get(nc_variable, nc_variable): nc_variable for nc_variable in nc_variables}
+    }
+
+
+class Catalog:
+    """Index of the NetCDF files under root: (variable, run, model) -> file and NetCDF variable.
+    The index is saved next to the files so a restart only rescans files added or changed since."""
+
+    def __init__(self, root:str=NETCDF_DIR):
+        self.root = root
+        self.files: dict[str, dict] = {} # path -> {"mtime", "run", "model", "kind", "hours", "leadtimes", "variables"}
+        self.entries: dict[tuple[str, datetime, str], CatalogEntry] = {} # Forecasts
+        self.analyses: dict[str, list[CatalogEntry]] = {} # variable -> analysis files ordered by run
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def index_path(self) -> Path:
+        return Path(self.root) / INDEX_NAME
+
+    def _load_index(self):
+        if self.index_path.exists():
+            with open(self.index_path, "r") as file:
+                self.files = json.load(file)
+        self._loaded = True
+
+    def _save_index(self):
+        # Write and rename so concurrent readers (gunicorn workers) never see a half written index
+        partial = self.index_path.with_suffix(f".json.{os.getpid()}.partial")
+        with open(partial, "w") as file:
+            json.dump(self.files, file)
+        os.replace(partial, self.index_path)
+
+    def refresh(self) -> int:
+        """Rescan the tree. Only files that are new or changed since the last scan are opened.
+        Returns the number of files opened."""
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            found = {}
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    if name.endswith(".nc"):
+                        path = os.path.join(directory, name)
+                        found[path] = os.stat(path).st_mtime_ns
+
+            scanned = 0
+            files = {}
+            for path, mtime in found.items():
+                record = self.files.get(path)
+                if record is None or record["mtime"] != mtime or "leadtimes" not in record:
+                    try:
+                        record = {"mtime": mtime, **scan_file(path)}
+                    except (OSError, ValueError) as e:
+                        print(f"Skipping {path}: {e}")
+                        continue
+                    scanned += 1
+                files[path] = record
+
+            entries = {}
+            analyses = {}
+            for path, record in sorted(files.items()):
+                run = datetime.fromisoformat(record["run"])
+                for variable, nc_variable in record["variables"].items():
+                    entry = CatalogEntry(variable, nc_variable, run, record["model"], path, record["kind"], tuple(record["hours"]), tuple(record["leadtimes"]))
+                    if entry.kind == "analysis":
+                        analyses.setdefault(variable, []).append(entry)
+                    else:
+                        entries[(variable, run, record["model"])] = entry
+            for files_of_variable in analyses.values():
+                files_of_variable.sort(key=lambda entry: (entry.run, entry.model))
+            changed = scanned > 0 or files.keys() != self.files.keys()
+            self.files = files
+            self.entries = entries # NOTE: Swapped whole, lookups do not take the lock
+            self.analyses = analyses
+            if changed and os.path.isdir(self.root):
+                self._save_index()
+            return scanned
+
+    def find(self, variable:str, run:datetime, model:Optional[str]=None) -> Optional[CatalogEntry]:
+        if model is not None:
+            return self.entries.get((variable, run, model.upper()))
+        entry = self.entries.get((variable, run, DEFAULT_MODEL))
+        if entry is None: # NOTE: Without the ensemble any single model will do
+            entry = next((entry for (v, r, _), entry in self.entries.items() if v == variable and r == run), None)
+        return entry
+
+    def lookup(self, variable:str, run:datetime, model:Optional[str]=None) -> CatalogEntry:
+        """File holding variable of run. A miss rescans the tree once, so newly downloaded files are found."""
+        entry = self.find(variable, run, model) if self._loaded else None
+        if entry is None:
+            self.refresh()
+            entry = self.find(variable, run, model)
+        if entry is None:
+            raise ValueError(f"No {variable} forecast for run {run} and {model=} under {self.root}. Runs: {self.runs(variable)}")
+        return entry
+
+    def analysis_files(self, variable:str, start:datetime, end:datetime, model:Optional[str]=None) -> list[CatalogEntry]:
+        """Analysis files of variable overlapping [start, end), oldest first. Rescans the tree first."""
+        self.refresh()
+        model = (model or DEFAULT_MODEL).upper()
+        return [
+            entry for entry in self.analyses.get(variable, [])
+            if entry.model == model
+            and entry.run + timedelta(hours=entry.hours[0]) < end
+            and entry.run + timedelta(hours=entry.hours[1] + 1) > start
+        ]
+
+    def runs(self, variable:str) -> list[datetime]:
+        return sorted({run for (v, run, _) in self.entries if v == variable})
+
+
+catalog = Catalog()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the CAMS NetCDF files under data/netcdf")
+    parser.add_argument("--root", default=NETCDF_DIR)
+    args = parser.parse_args()
+
+    index = Catalog(args.root)
+    scanned = index.refresh()
+    print(f"Scanned {scanned} files, {len(index.files)} in {index.index_path}")
+    entries = [*index.entries.values(), *(entry for files in index.analyses.values() for entry in files)]
+    for entry in sorted(entries, key=lambda entry: (entry.variable, entry.kind, entry.run, entry.model)):
+        print(f"{entry.variable:16} {entry.kind:9} {entry.run:%Y-%m-%d %H:%M} {entry.model:8} {entry.nc_variable:12} {entry.path}")
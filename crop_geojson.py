@@ -1,9 +1,175 @@
+import os
+import sys
 import json
+import mmap
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator
 
+import numpy as np
+
+import metrics
 from geodata import GeoJSON, GeoJSONlimits
 
 
+EUROPE_GEOJSON_PATH = "data/geojson/europe.forecast.geo.json"
+INDEX_CELL_SIZE = 1.0 # degrees
+READ_CHUNK_SIZE = 2**20
+
+
+@dataclass
+class GeoJSONIndex:
+    """Feature centroids and byte ranges of a GeoJSON file, bucketed into a uniform lon/lat grid."""
+    source_mtime: int
+    source_size: int
+    centroids: np.ndarray # (n, 2) lon lat
+    offsets: np.ndarray # byte offset of each feature object in the file
+    lengths: np.ndarray # byte length of each feature object
+    order: np.ndarray # feature positions sorted by grid cell
+    cell_starts: np.ndarray # order[cell_starts[c]:cell_starts[c+1]] are the features of cell c
+    lon0: float
+    lat0: float
+    cell_size: float
+    n_cols: int
+    n_rows: int
+
+    def query(self, limits:GeoJSONlimits) -> np.ndarray:
+        """Positions, in file order, of the features whose centroid is strictly inside limits."""
+        col_range = np.clip(np.floor((np.array([limits["west"], limits["east"]]) - self.lon0) / self.cell_size).astype(int), 0, self.n_cols - 1)
+        row_range = np.clip(np.floor((np.array([limits["south"], limits["north"]]) - self.lat0) / self.cell_size).astype(int), 0, self.n_rows - 1)
+        candidates = [
+            self.order[self.cell_starts[row * self.n_cols + col_range[0]]:self.cell_starts[row * self.n_cols + col_range[1] + 1]]
+            for row in range(row_range[0], row_range[1] + 1)
+        ]
+        candidates = np.sort(np.concatenate(candidates)) if candidates else np.empty(0, dtype=np.int64)
+        lon = self.centroids[candidates, 0]
+        lat = self.centroids[candidates, 1]
+        inside = ((lon > limits["west"]) & (lon < limits["east"]) &
+                  (lat < limits["north"]) & (lat > limits["south"]))
+        return candidates[inside]
+
+
+def index_path_for(geojson_path:Path|str) -> Path:
+    return Path(f"{geojson_path}.index.npz")
+
+
+def iter_feature_spans(geojson_path:Path|str) -> Iterator[tuple[int, int, dict]]:
+    """Stream (byte offset, byte length, feature) of every feature without loading the whole file.
+    NOTE: Decoded as latin-1 so that string positions are byte positions. Only ASCII structure and numbers are used."""
+    decoder = json.JSONDecoder()
+    with open(geojson_path, "rb") as file:
+        buffer = ""
+        buffer_offset = 0 # File position of buffer[0]
+        eof = False
+
+        def read_more() -> bool:
+            nonlocal buffer, eof
+            chunk = file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk.decode("latin-1")
+            return not eof
+
+        while (start := buffer.find('"features"')) == -1:
+            if not read_more(): raise ValueError(f"No features in {geojson_path}")
+        while (position := buffer.find("[", start)) == -1:
+            if not read_more(): raise ValueError(f"No features in {geojson_path}")
+        position += 1
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                if not read_more(): raise ValueError(f"Unterminated features in {geojson_path}")
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not read_more(): raise
+                continue
+            yield buffer_offset + position, end - position, feature
+            position = end
+            if position > READ_CHUNK_SIZE:
+                # Drop parsed text so the buffer stays around one chunk
+                buffer = buffer[position:]
+                buffer_offset += position
+                position = 0
+
+
+@metrics.timed("crop_geojson.build_index")
+def build_geojson_index(geojson_path:Path|str=EUROPE_GEOJSON_PATH, cell_size:float=INDEX_CELL_SIZE) -> GeoJSONIndex:
+    """One-time preprocessing: stream the GeoJSON once and write the centroid index next to it."""
+    stat = os.stat(geojson_path)
+    centroids, offsets, lengths = [], [], []
+    for offset, length, feature in iter_feature_spans(geojson_path):
+        centroids.append(feature["geometry"]["centroid"][:2])
+        offsets.append(offset)
+        lengths.append(length)
+    centroids = np.array(centroids, dtype=np.float64).reshape(-1, 2)
+
+    lon0 = float(np.floor(centroids[:, 0].min())) if len(centroids) else 0.0
+    lat0 = float(np.floor(centroids[:, 1].min())) if len(centroids) else 0.0
+    cols = np.floor((centroids[:, 0] - lon0) / cell_size).astype(np.int64)
+    rows = np.floor((centroids[:, 1] - lat0) / cell_size).astype(np.int64)
+    n_cols = int(cols.max()) + 1 if len(centroids) else 1
+    n_rows = int(rows.max()) + 1 if len(centroids) else 1
+    cells = rows * n_cols + cols
+    order = np.argsort(cells, kind="stable")
+
+    index = GeoJSONIndex(
+        source_mtime=stat.st_mtime_ns,
+        source_size=stat.st_size,
+        centroids=centroids,
+        offsets=np.array(offsets, dtype=np.int64),
+        lengths=np.array(lengths, dtype=np.int64),
+        order=order,
+        cell_starts=np.searchsorted(cells[order], np.arange(n_rows * n_cols + 1)),
+        lon0=lon0,
+        lat0=lat0,
+        cell_size=cell_size,
+        n_cols=n_cols,
+        n_rows=n_rows
+    )
+    # Write and rename so a crash or a concurrent builder never leaves a truncated index
+    partial = Path(f"{index_path_for(geojson_path)}.{os.getpid()}.partial")
+    with open(partial, "wb") as file:
+        np.savez(file, **index.__dict__)
+    os.replace(partial, index_path_for(geojson_path))
+    return index
+
+
+_indexes: dict[str, GeoJSONIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def load_geojson_index(geojson_path:Path|str=EUROPE_GEOJSON_PATH) -> GeoJSONIndex:
+    """Cached index of a GeoJSON file. Built on first use and rebuilt when the GeoJSON changes."""
+    stat = os.stat(geojson_path)
+    key = str(geojson_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if not index or index.source_mtime != stat.st_mtime_ns or index.source_size != stat.st_size:
+            index = None
+            if index_path_for(geojson_path).exists():
+                with np.load(index_path_for(geojson_path)) as arrays:
+                    index = GeoJSONIndex(**{name: arrays[name] if arrays[name].ndim else arrays[name].item() for name in arrays.files})
+                if index.source_mtime != stat.st_mtime_ns or index.source_size != stat.st_size:
+                    index = None
+            index = index or build_geojson_index(geojson_path)
+            _indexes[key] = index
+        return index
+
+
+def read_features(geojson_path:Path|str, index:GeoJSONIndex, positions:np.ndarray) -> Iterator[dict]:
+    """Parse only the features at positions."""
+    with open(geojson_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset, length in zip(index.offsets[positions].tolist(), index.lengths[positions].tolist()):
+            yield json.loads(data[offset:offset + length])
+
+
+@metrics.timed("crop_geojson.crop")
 def crop_geojson(limits:GeoJSONlimits, geojson:GeoJSON|Path|str|None=None, target_filename:Path|str=None) -> GeoJSON:
     """Crop big geojson into smaller area. Defaults to europe.forecast.geo.json.
     If target path is given, writes a JSON-file. Only include a filename to the path."""
@@ -18,16 +184,17 @@ def crop_geojson(limits:GeoJSONlimits, geojson:GeoJSON|Path|str|None=None, targe
         raise ValueError("Target filename should only include filename")
     
     if geojson is None:
-        with open("data/geojson/europe.forecast.geo.json", "r") as file:
-            geojson = json.load(file)
-    elif isinstance(geojson, (Path, str)):
-        with open(geojson, "r") as file:
-            geojson = json.load(file)
+        geojson = EUROPE_GEOJSON_PATH
+    if isinstance(geojson, (Path, str)):
+        # Indexed crop: only the features inside limits are read and parsed
+        index = load_geojson_index(geojson)
+        features = read_features(geojson, index, index.query(limits))
     elif isinstance(geojson, dict):
         if ("type" not in geojson.keys() or
             "features" not in geojson.keys()):
             raise ValueError("GeoJSON should have keys: 'type' and 'features'")
-    
+        features = geojson["features"]
+
     sub_region = {
         "type": "FeatureCollection",
         "center": {"lat": round((limits["south"]+limits["north"])/2, 2), "lon": round((limits["west"]+limits["east"])/2, 2)},
@@ -40,7 +207,7 @@ def crop_geojson(limits:GeoJSONlimits, geojson:GeoJSON|Path|str|None=None, targe
         "features": []
     }
 
-    for feature in geojson["features"]:
+    for feature in features:
         centroid = feature["geometry"]["centroid"]
         lon = centroid[0]
         lat = centroid[1]
@@ -65,6 +232,11 @@ def crop_geojson(limits:GeoJSONlimits, geojson:GeoJSON|Path|str|None=None, targe
     return sub_region
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--index":
+        # python crop_geojson.py --index [geojson_path]
+        index = build_geojson_index(*sys.argv[2:3])
+        print(f"Indexed {len(index.offsets)} features")
+        sys.exit()
     result = crop_geojson({
         "north": 51,
         "south": 50,
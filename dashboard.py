@@ -0,0 +1,311 @@
+import os
+import json
+import math
+import time
+import base64
+import hashlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+import plotly.graph_objects as go
+
+import geodata
+import metrics
+from geodata import GeoJSON
+import crop_geojson
+import lod
+import tiles
+from catalog import catalog
+from pollution import accumulation_intervals, exposure_map_intervals, location_series, Coordinate
+
+# Region & data config
+CITY_REGIONS = {
+    "Paris": {"north": 54, "south": 44, "west": -4, "east": 8}
+}
+
+REGION = "Paris"
+TIME_SPAN = 12
+DATETIME = datetime(2025, 5, 10, 0, 0) # Run shown when the catalog has no PM10 forecast, see latest_run
+MAP_ZOOM = 5
+MAP_ZRANGE = (2, 20) # Color scale of the concentration layer
+
+GEOJSON_URL = "/geojson/{level}/{etag}.json" # Served by main.py
+SNAPSHOT_DIR = "data/snapshot"
+SNAPSHOT_NAME = "dashboard.npz" # Arrays and metadata in one file, see save_snapshot
+SNAPSHOT_VERSION = 6 # NOTE: bump when the derived state or figures change shape
+
+
+@dataclass
+class DashboardState:
+    """Everything the layout and callbacks need, derived from the forecast and GeoJSON files."""
+    forecast: xr.DataArray # (leadtime, lat, lon)
+    cumulative_exposure: list[float]
+    map_figure: dict # plotly JSON
+    chart_figure: dict # plotly JSON
+    frames: dict # see encode_frames
+    dose_frames: dict # Frames of the dose map layer, see get_dose_map
+    lod: list[lod.LODLevel] # GeoJSON and values of each map level of detail
+    key: Optional[dict] = None # see snapshot_key
+
+    @property
+    def run(self) -> datetime:
+        return self.forecast.attrs["time"]
+
+    @property
+    def version(self) -> str:
+        return data_version(self.key) if self.key else ""
+
+
+class Timings(dict):
+    """Seconds per startup phase, in the order they ran."""
+
+    @contextmanager
+    def phase(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = time.perf_counter() - start
+            metrics.observe("startup_seconds", self[name], phase=name)
+
+    def __str__(self) -> str:
+        return ", ".join(f"{name} {seconds*1000:.0f} ms" for name, seconds in self.items())
+
+
+def get_geojson(region) -> GeoJSON:
+    # NOTE: Assembled from cached tiles, so further regions reuse the crops of overlapping ones
+    return tiles.geojson_region(CITY_REGIONS[region], crop_geojson.EUROPE_GEOJSON_PATH)
+
+def get_forecast(time_span:int, geojson:GeoJSON, run:datetime=DATETIME) -> xr.DataArray:
+    return tiles.forecast_region("PM10", run, [_ for _ in range(time_span+1)], geojson["limits"])
+
+def latest_run(variable:str="PM10") -> datetime:
+    """Newest run in the catalog. The catalog rescans only files added or changed since the last call."""
+    catalog.refresh()
+    runs = catalog.runs(variable)
+    return runs[-1] if runs else DATETIME
+
+def get_cumulative_exposure(forecast:xr.DataArray):
+    time_span = len(forecast["leadtime"]) - 1
+    hourly_values = location_series(forecast, Coordinate(lon=2.35, lat=48.85))
+    exposure_ends = np.arange(1, time_span+1)
+    cumulative_exposure = accumulation_intervals(
+        hourly_values, np.zeros(time_span), exposure_ends,
+        air_intake_cubics_per_minute=1
+    )
+    cumulative_exposure = [0] + cumulative_exposure.tolist()
+    return cumulative_exposure
+
+def get_dose_map(forecast:xr.DataArray) -> xr.DataArray:
+    """(leadtime, lat, lon) inhaled PM10 of every grid cell from run time until each leadtime, the map
+    counterpart of get_cumulative_exposure."""
+    leadtimes = forecast["leadtime"].values
+    dose = exposure_map_intervals(forecast, np.zeros(len(leadtimes)), leadtimes, air_intake_cubics_per_minute=1)
+    return dose.rename(interval="leadtime").assign_coords(leadtime=leadtimes)
+
+def encode_frames(levels:list[lod.LODLevel], cumulative_exposure:list[float], zrange:tuple[float, float]=MAP_ZRANGE) -> dict:
+    """All slider frames of every level of detail for the browser. Values are quantized to uint16 between the
+    data minimum and maximum and sent as base64, half the bytes of float32 with an error below 1/65534 of the
+    value range. 65535 marks missing values. The GeoJSON of a level is fetched from its url when first shown.
+    zrange is the color scale of the frames."""
+    finite_values = np.concatenate([level.values[np.isfinite(level.values)] for level in levels])
+    offset = float(finite_values.min()) if finite_values.size else 0.0
+    scale = (float(finite_values.max()) - offset) / 65534 if finite_values.size else 0.0
+    encoded = []
+    for position, level in enumerate(levels):
+        finite = np.isfinite(level.values)
+        quantized = np.full(level.values.shape, 65535, dtype="<u2")
+        quantized[finite] = np.rint((level.values[finite] - offset) / (scale or 1))
+        encoded.append({
+            "cells": level.cells,
+            "min_zoom": level.min_zoom,
+            "geojson": GEOJSON_URL.format(level=position, etag=level.etag),
+            "z": base64.b64encode(quantized.tobytes()).decode("ascii")
+        })
+    return {
+        "offset": offset,
+        "scale": scale,
+        "levels": encoded,
+        "zrange": list(zrange),
+        "cumulative_exposure": cumulative_exposure
+    }
+
+
+# Helper to build map figure
+def create_map_figure(geojson:GeoJSON|str, locations:list[str], z:np.ndarray|list):
+    """geojson may be a url, plotly then fetches it in the browser."""
+    fig = go.Figure(go.Choroplethmap(
+        geojson=geojson,
+        featureidkey="id",
+        locations=locations,
+        z=z,
+        colorscale="Bupu",
+        marker=dict(opacity=0.4, line_width=0),
+        hovertemplate="%{properties.cell}<br>%{z}<extra></extra>", # NOTE: Feature ids are short indices, see lod.compact_feature
+        zmin=MAP_ZRANGE[0],
+        zmax=MAP_ZRANGE[1]
+    ))
+    fig.update_layout(
+        map_center=dict(lon=2, lat=49),
+        map_zoom=MAP_ZOOM,
+        margin=dict(l=0, r=0, t=20, b=0),
+        uirevision="map" # Keep the user's zoom when forecast.js swaps levels
+    )
+    return fig
+
+
+# Helper to build scatter plot
+def create_chart_figure(leadtime, cumulative_exposure:list[float]):
+    fig = go.Figure(go.Scatter(
+        x=[i for i in range(TIME_SPAN+1)],
+        y=cumulative_exposure[:leadtime+1],
+        mode="lines+markers",
+        name="PM10"
+    ),
+    layout_yaxis_range=[-100, math.ceil(cumulative_exposure[-1]/100)*100], # NOTE setting y-axis allows to see climbing motion when slider in moved
+    layout_xaxis_range=[-TIME_SPAN/10, TIME_SPAN+(TIME_SPAN/10)] # NOTE setting y-axis allows to see climbing motion when slider in moved
+    )
+    fig.update_layout(
+        yaxis_title="PM10",
+        xaxis_title="Leadtime",
+        margin=dict(l=40, r=10, t=20, b=40)
+    )
+    return fig
+
+
+def build_state(timings:Timings, run:datetime=DATETIME, previous:Optional[DashboardState]=None) -> DashboardState:
+    """previous is a state of the same region and GeoJSON, eg. of the last run. Its map levels are reused
+    when the grid is unchanged, so only their values are recomputed."""
+    with timings.phase("crop geojson"):
+        geojson = get_geojson(REGION)
+    with timings.phase("read forecast"):
+        forecast = get_forecast(TIME_SPAN, geojson, run)
+    with timings.phase("level of detail"):
+        if previous is not None and all(np.array_equal(previous.forecast[axis].values, forecast[axis].values) for axis in ("lat", "lon")):
+            levels = lod.level_values(previous.lod, forecast)
+        else:
+            levels = lod.build_lod(geojson, forecast)
+    with timings.phase("exposure"):
+        cumulative_exposure = get_cumulative_exposure(forecast)
+    with timings.phase("dose map"):
+        # NOTE: Same features as the concentration levels, only the values differ
+        dose_levels = lod.level_values(levels, get_dose_map(forecast))
+        dose_max = max((float(np.nanmax(level.values)) for level in dose_levels if np.isfinite(level.values).any()), default=1.0)
+        dose_frames = encode_frames(dose_levels, cumulative_exposure, zrange=(0, dose_max))
+    with timings.phase("figures"):
+        # NOTE: Kept as plotly JSON so the same dicts can be written to and read from the snapshot.
+        # Locations and values are filled in by forecast.js on page load, the GeoJSON is fetched from its url.
+        level = lod.level_for_zoom(levels, MAP_ZOOM)
+        map_figure = json.loads(create_map_figure(GEOJSON_URL.format(level=level, etag=levels[level].etag), [], []).to_json())
+        chart_figure = json.loads(create_chart_figure(0, cumulative_exposure).to_json())
+        frames = encode_frames(levels, cumulative_exposure)
+    return DashboardState(forecast, cumulative_exposure, map_figure, chart_figure, frames, dose_frames, levels)
+
+
+def snapshot_key(run:datetime=DATETIME) -> dict:
+    """Inputs of the derived state. A snapshot is valid only while all of them are unchanged."""
+    files = [crop_geojson.EUROPE_GEOJSON_PATH, geodata.forecast_source("PM10", run)]
+    return {
+        "version": SNAPSHOT_VERSION,
+        "region": CITY_REGIONS[REGION],
+        "datetime": run.isoformat(),
+        "time_span": TIME_SPAN,
+        "files": {file: os.stat(file).st_mtime_ns for file in files}
+    }
+
+
+def data_version(key:dict) -> str:
+    """Short hash of the snapshot key, it changes whenever the derived state would."""
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def save_snapshot(state:DashboardState, key:dict, snapshot_dir:str=SNAPSHOT_DIR):
+    """Arrays and JSON metadata, key included, in one npz, so a reader never pairs arrays and metadata of
+    different builds."""
+    directory = Path(snapshot_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    meta = json.dumps({
+        "key": key,
+        "lod": [{"factor": level.factor, "min_zoom": level.min_zoom, "etag": level.etag} for level in state.lod],
+        "cumulative_exposure": state.cumulative_exposure,
+        "map_figure": state.map_figure,
+        "chart_figure": state.chart_figure,
+        "frames": state.frames,
+        "dose_frames": state.dose_frames
+    }).encode("utf-8")
+    # Write and rename so a crash never leaves a half written snapshot. NOTE: pid in the name, gunicorn workers refresh concurrently
+    partial = directory / f"{SNAPSHOT_NAME}.{os.getpid()}.partial"
+    with open(partial, "wb") as file:
+        np.savez(
+            file,
+            meta=np.frombuffer(meta, dtype=np.uint8),
+            values=state.forecast.values,
+            leadtime=state.forecast["leadtime"].values,
+            lat=state.forecast["lat"].values,
+            lon=state.forecast["lon"].values,
+            **{f"lod{position}_values": level.values for position, level in enumerate(state.lod)},
+            **{f"lod{position}_geojson": np.frombuffer(level.geojson, dtype=np.uint8) for position, level in enumerate(state.lod)},
+            **{f"lod{position}_index": level.index for position, level in enumerate(state.lod)}
+        )
+    os.replace(partial, directory / SNAPSHOT_NAME)
+
+
+def load_snapshot(key:dict, snapshot_dir:str=SNAPSHOT_DIR) -> DashboardState|None:
+    path = Path(snapshot_dir) / SNAPSHOT_NAME
+    if not path.exists():
+        return None
+    with np.load(path) as arrays:
+        if "meta" not in arrays.files: # Written before the metadata moved into the npz
+            return None
+        snapshot = json.loads(arrays["meta"].tobytes())
+        if snapshot["key"] != key:
+            return None
+        forecast = xr.DataArray(
+            arrays["values"],
+            dims=("leadtime", "lat", "lon"),
+            coords={"leadtime": arrays["leadtime"], "lat": arrays["lat"], "lon": arrays["lon"]},
+            name="PM10",
+            attrs={"time": datetime.fromisoformat(key["datetime"])}
+        )
+        levels = [
+            lod.LODLevel(level["factor"], level["min_zoom"], arrays[f"lod{position}_values"], arrays[f"lod{position}_geojson"].tobytes(), level["etag"], arrays[f"lod{position}_index"])
+            for position, level in enumerate(snapshot["lod"])
+        ]
+    return DashboardState(
+        forecast=forecast,
+        cumulative_exposure=snapshot["cumulative_exposure"],
+        map_figure=snapshot["map_figure"],
+        chart_figure=snapshot["chart_figure"],
+        frames=snapshot["frames"],
+        dose_frames=snapshot["dose_frames"],
+        lod=levels,
+        key=key
+    )
+
+
+def load_state(timings:Timings, previous:Optional[DashboardState]=None, build:bool=True) -> DashboardState|None:
+    """Derived state of the latest run, from the snapshot when its inputs are unchanged, otherwise built and
+    snapshotted. Returns previous itself when nothing changed since it was built, or when build is False and
+    there is no snapshot to load."""
+    with timings.phase("snapshot key"):
+        key = snapshot_key(latest_run())
+    if previous is not None and previous.key == key:
+        return previous
+    with timings.phase("load snapshot"):
+        state = load_snapshot(key)
+    if state is None and not build:
+        return previous
+    if state is None:
+        same_map = previous is not None and previous.key is not None and all(
+            previous.key[name] == key[name] for name in ("version", "region", "time_span")
+        ) and previous.key["files"].get(crop_geojson.EUROPE_GEOJSON_PATH) == key["files"][crop_geojson.EUROPE_GEOJSON_PATH]
+        state = build_state(timings, datetime.fromisoformat(key["datetime"]), previous if same_map else None)
+        state.key = key
+        with timings.phase("save snapshot"):
+            save_snapshot(state, key)
+    return state
@@ -0,0 +1,207 @@
+"""Filter replacement predictions for a fleet of buildings.
+
+    python fleet.py sites.csv --run 2025-05-10 --output replacements.csv
+
+Sites are read from CSV or Parquet with the columns lon, lat, filter_capacity and either
+air_intake_cubics_per_minute or air_intake_litres_per_minute. Optional are site (an id, the row number
+by default) and filter_load, the load already in the filter at run time. Loads are in the unit of
+pollution.accumulation, eg. µg for PM10 in µg/m³."""
+import time
+import argparse
+from collections import deque
+from concurrent.futures import Executor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Literal, Optional
+
+import numpy as np
+import pandas as pd
+
+import geodata
+import metrics
+from geodata import ForecastMultiQuery
+from grid import GridIndex
+from pollution import filter_replacement_hours
+
+
+CHUNK_SIZE = 5000 # Sites per pool task
+CROP_MARGIN = 0.25 # Degrees around the sites of a chunk, more than a grid cell so edge sites have neighbours
+
+
+def read_sites(path:str, chunk_size:int=CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Sites in chunks of chunk_size rows, so the input file is never loaded whole."""
+    if Path(path).suffix.lower() in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet needs pyarrow: pip install pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def site_arrays(sites:pd.DataFrame, offset:int) -> dict[str, np.ndarray]:
+    """Validated columns of a chunk of sites. offset is the row number of the first site.
+    NOTE: Plain arrays are sent to the pool workers, they pickle much faster than DataFrames."""
+    missing = {"lon", "lat", "filter_capacity"} - set(sites.columns)
+    if missing:
+        raise ValueError(f"Sites are missing columns {sorted(missing)}")
+    if "air_intake_cubics_per_minute" in sites and "air_intake_litres_per_minute" in sites:
+        raise ValueError("Give only either air_intake_cubics_per_minute or air_intake_litres_per_minute")
+    if "air_intake_cubics_per_minute" in sites:
+        in_take = sites["air_intake_cubics_per_minute"].to_numpy(dtype=np.float64)
+    elif "air_intake_litres_per_minute" in sites:
+        in_take = sites["air_intake_litres_per_minute"].to_numpy(dtype=np.float64) * 0.001
+    else:
+        raise ValueError("Give either air_intake_cubics_per_minute or air_intake_litres_per_minute")
+
+    n_sites = len(sites)
+    return {
+        "site": sites["site"].to_numpy() if "site" in sites else np.arange(offset, offset + n_sites),
+        "lon": sites["lon"].to_numpy(dtype=np.float64),
+        "lat": sites["lat"].to_numpy(dtype=np.float64),
+        "air_intake_cubics_per_minute": in_take,
+        "filter_capacity": sites["filter_capacity"].to_numpy(dtype=np.float64),
+        "filter_load": sites["filter_load"].to_numpy(dtype=np.float64) if "filter_load" in sites else np.zeros(n_sites)
+    }
+
+
+def hourly_axis(values:np.ndarray, leadtimes:list[int]) -> np.ndarray:
+    """(hour, site) values of every hour from the first to the last leadtime. Hours missing from a gapped time
+    axis are NaN like in pollution.location_series, so their sites get NaN hours instead of shifted ones."""
+    first = min(leadtimes)
+    hourly = np.full((max(leadtimes) - first + 1, *values.shape[1:]), np.nan)
+    hourly[np.asarray(leadtimes) - first] = values
+    return hourly
+
+
+def predict_chunk(sites:dict[str, np.ndarray], variable:str, run:datetime, model:Optional[str], leadtimes:list[int]) -> dict[str, np.ndarray]:
+    """Replacement hours of a chunk of sites. Runs in pool workers, only the bounding box of the chunk is read.
+    Sites outside the forecast grid, or on a time axis with gaps, get NaN hours."""
+    n_sites = len(sites["lon"])
+    hours = np.full(n_sites, np.nan)
+    within_forecast = np.zeros(n_sites, dtype=bool)
+    load_at_end = np.full(n_sites, np.nan)
+
+    finite = np.isfinite(sites["lon"]) & np.isfinite(sites["lat"])
+    if finite.any():
+        limits = {
+            "north": float(sites["lat"][finite].max()) + CROP_MARGIN,
+            "south": float(sites["lat"][finite].min()) - CROP_MARGIN,
+            "west": float(sites["lon"][finite].min()) - CROP_MARGIN,
+            "east": float(sites["lon"][finite].max()) + CROP_MARGIN
+        }
+        try:
+            forecast = geodata.query_forecast(ForecastMultiQuery(variable, run, leadtimes, model, limits), as_array=True)
+        except ValueError: # No grid cells within the chunk, all sites are outside the forecast area
+            forecast = None
+        if forecast is not None:
+            grid = GridIndex.from_dataarray(forecast)
+            inside = finite & grid.contains(sites["lon"], sites["lat"])
+            i, j = grid.nearest(sites["lon"][inside], sites["lat"][inside])
+            hourly_values = hourly_axis(forecast.values[:, i, j], leadtimes) # (hour, site)
+            hours[inside], within_forecast[inside] = filter_replacement_hours(
+                hourly_values,
+                sites["air_intake_cubics_per_minute"][inside],
+                sites["filter_capacity"][inside],
+                sites["filter_load"][inside]
+            )
+            hours += min(leadtimes) # Hours since run, the filters start collecting at the first leadtime
+            load_at_end[inside] = sites["filter_load"][inside] + (hourly_values * 60).sum(axis=0) * sites["air_intake_cubics_per_minute"][inside]
+
+    return {"site": sites["site"], "lon": sites["lon"], "lat": sites["lat"], "hours": hours, "within_forecast": within_forecast, "load_at_forecast_end": load_at_end}
+
+
+def bounded_map(executor:Optional[Executor], func, items:Iterator, window:int) -> Iterator:
+    """executor.map that keeps at most window tasks in flight, so a long input is not read ahead whole.
+    Results come in input order."""
+    if executor is None:
+        yield from map(func, items)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _predict(task:tuple) -> dict[str, np.ndarray]:
+    return predict_chunk(*task)
+
+
+def predict_fleet(sites:Iterator[pd.DataFrame], variable:str, run:datetime, model:Optional[str]=None, leadtimes:Optional[list[int]]=None, kind:Literal["process", "thread", "serial"]=geodata.READ_EXECUTOR, workers:int=geodata.READ_WORKERS) -> Iterator[pd.DataFrame]:
+    """Replacement predictions for chunks of sites, one frame per chunk in input order.
+    Chunks are spread over the geodata read pool (see geodata.read_executor).
+    Columns: site, lon, lat, hours (since run), replacement_time, within_forecast, load_at_forecast_end.
+    Replacements after the forecast extrapolate its mean rate and have within_forecast False."""
+    leadtimes = leadtimes or geodata.forecast_leadtimes(variable, run, model)
+    executor = geodata.read_executor(kind, workers)
+
+    def tasks():
+        offset = 0
+        for chunk in sites:
+            yield (site_arrays(chunk, offset), variable, run, model, leadtimes)
+            offset += len(chunk)
+
+    for result in bounded_map(executor, _predict, tasks(), window=2 * max(workers, 1)):
+        df = pd.DataFrame(result)
+        finite = np.isfinite(df["hours"].to_numpy())
+        replacement = np.full(len(df), np.datetime64("NaT"), dtype="datetime64[s]")
+        replacement[finite] = np.datetime64(run, "s") + (df["hours"].to_numpy()[finite] * 3600).round().astype("timedelta64[s]")
+        df.insert(4, "replacement_time", replacement)
+        metrics.increment("fleet_sites_total", len(df))
+        yield df
+
+
+def write_results(results:Iterator[pd.DataFrame], path:str) -> int:
+    """Append result chunks to CSV or Parquet as they arrive. Returns the number of sites written."""
+    n_sites = 0
+    if Path(path).suffix.lower() in (".parquet", ".pq"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet needs pyarrow: pip install pyarrow")
+        writer = None
+        try:
+            for df in results:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                n_sites += len(df)
+        finally:
+            if writer: writer.close()
+        return n_sites
+
+    with open(path, "w", newline="") as file:
+        for df in results:
+            df.to_csv(file, header=n_sites == 0, index=False)
+            n_sites += len(df)
+    return n_sites
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict when the air filters of many sites need replacing")
+    parser.add_argument("sites", help="CSV or Parquet file of sites")
+    parser.add_argument("--output", required=True, help="CSV or Parquet file for the predictions")
+    parser.add_argument("--variable", default="PM10")
+    parser.add_argument("--run", required=True, type=datetime.fromisoformat, help="Forecast run time, eg. 2025-05-10T00")
+    parser.add_argument("--model")
+    parser.add_argument("--hours", type=int, help="Use only the first hours of the forecast, counted from its first leadtime")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--executor", default=geodata.READ_EXECUTOR, choices=["process", "thread", "serial"])
+    parser.add_argument("--workers", type=int, default=geodata.READ_WORKERS)
+    args = parser.parse_args()
+
+    leadtimes = geodata.forecast_leadtimes(args.variable, args.run, args.model)
+    if args.hours:
+        leadtimes = [hour for hour in leadtimes if hour < leadtimes[0] + args.hours] # NOTE: By hour, the axis may have gaps
+    start = time.perf_counter()
+    results = predict_fleet(read_sites(args.sites, args.chunk_size), args.variable, args.run, args.model, leadtimes, args.executor, args.workers)
+    n_sites = write_results(results, args.output)
+    seconds = time.perf_counter() - start
+    print(f"Predicted {n_sites} sites in {seconds:.2f} s, {n_sites / seconds:.0f} sites/s, written to {args.output}")
+    geodata.close_executors()
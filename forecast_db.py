@@ -0,0 +1,120 @@
+import os
+import argparse
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import xarray as xr
+
+from catalog import time_hours
+
+
+DB_PATH = "AirQuality.db"
+DATETIME_FORMAT = "%Y/%m/%d %H:%M"
+
+# NOTE: datetime is the forecast run, leadtime the valid time. Both "%Y/%m/%d %H:%M" so text order is time order.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS forecasts (
+        variable_name TEXT NOT NULL,
+        datetime TEXT NOT NULL,
+        leadtime TEXT NOT NULL,
+        model TEXT,
+        lon REAL NOT NULL,
+        lat REAL NOT NULL,
+        value REAL
+    );
+"""
+INDEXES = """
+    CREATE INDEX IF NOT EXISTS forecasts_lookup ON forecasts (variable_name, datetime, leadtime, lon, lat);
+"""
+
+_local = threading.local()
+
+
+def connect(db_path:str=DB_PATH) -> sqlite3.Connection:
+    """Read-only connection for this thread, reused between queries.
+    NOTE: Keyed by pid too, a connection must not cross a fork (gunicorn workers)."""
+    key = (os.getpid(), db_path)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute("PRAGMA mmap_size = 268435456")
+        conn.execute("PRAGMA cache_size = -32000")
+        connections[key] = conn
+    return conn
+
+
+def create_schema(conn:sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode = WAL") # Readers do not block the loader and vice versa
+    conn.executescript(SCHEMA)
+
+
+def load_netcdf(nc_path:str, variable:str, nc_variable:str, run:datetime, model:str=None, db_path:str=DB_PATH) -> int:
+    """Bulk load one NetCDF variable into the forecasts table. Replaces earlier rows of the same run.
+    Each leadtime is inserted with executemany in its own transaction. Returns the number of rows."""
+    conn = sqlite3.connect(db_path)
+    try:
+        create_schema(conn)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        with conn:
+            conn.execute(
+                "DELETE FROM forecasts WHERE variable_name=? AND datetime=? AND model IS ?",
+                (variable, run.strftime(DATETIME_FORMAT), model)
+            )
+
+        rows = 0
+        with xr.open_dataset(nc_path, engine="netcdf4", decode_timedelta=False) as ds:
+            data = ds[nc_variable]
+            if "level" in data.dims:
+                data = data.isel(level=0)
+            data = data.transpose("time", "latitude", "longitude")
+            # Same -180..180 longitudes and 2 decimal coordinates as the NetCDF frames in geodata
+            longitude = [round(lon if lon < 180 else lon - 360, 2) for lon in ds["longitude"].values.astype(np.float64).tolist()]
+            latitude = [round(lat, 2) for lat in ds["latitude"].values.astype(np.float64).tolist()]
+            lon_column = np.tile(longitude, len(latitude)).tolist()
+            lat_column = np.repeat(latitude, len(longitude)).tolist()
+
+            hours = time_hours(ds["time"].values) # NOTE: The time axis may not start at 0 or may have gaps
+            for position, hour in enumerate(hours.tolist()):
+                values = data.isel(time=position).values.astype(np.float64).ravel().tolist()
+                valid_time = (run + timedelta(hours=hour)).strftime(DATETIME_FORMAT)
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO forecasts (variable_name, datetime, leadtime, model, lon, lat, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        zip(
+                            [variable] * len(values),
+                            [run.strftime(DATETIME_FORMAT)] * len(values),
+                            [valid_time] * len(values),
+                            [model] * len(values),
+                            lon_column,
+                            lat_column,
+                            values
+                        )
+                    )
+                rows += len(values)
+
+        # NOTE: Building the index once after the load is much faster than updating it on every insert
+        conn.executescript(INDEXES)
+        conn.execute("ANALYZE")
+        return rows
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load CAMS NetCDF forecasts into SQLite")
+    parser.add_argument("file")
+    parser.add_argument("--variable", required=True, help="Query variable, eg. PM10")
+    parser.add_argument("--nc-variable", required=True, help="Variable inside the NetCDF file, eg. pm10_conc")
+    parser.add_argument("--run", required=True, type=datetime.fromisoformat, help="Forecast run time, eg. 2025-05-10T00")
+    parser.add_argument("--model")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    rows = load_netcdf(args.file, args.variable, args.nc_variable, args.run, args.model, args.db)
+    print(f"Loaded {rows} rows into {args.db}")
@@ -0,0 +1,190 @@
+import os
+import json
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+from catalog import DEFAULT_MODEL, model_from_path, run_from_path, time_hours
+
+
+STORE_DIR = "data/store"
+MANIFEST_NAME = "manifest.json"
+RUN_FORMAT = "%Y%m%dT%H"
+
+
+@dataclass
+class StoreRun:
+    """One ingested forecast run of one variable and model. values is a read-only np.memmap, slicing it does not copy."""
+    variable: str
+    run: datetime
+    model: str
+    path: str
+    mtime: int
+    values: np.ndarray # (leadtime, lat, lon) float32
+    leadtimes: list[int]
+    longitude: np.ndarray # NOTE: as in the NetCDF file, 0..360
+    latitude: np.ndarray # NOTE: descending order
+
+    def positions(self, leadtimes:list[int]) -> slice|list[int]:
+        """Index of leadtimes on the time axis. Consecutive leadtimes give a slice so the read stays a view."""
+        try:
+            positions = [self.leadtimes.index(leadtime) for leadtime in leadtimes]
+        except ValueError:
+            raise ValueError(f"Leadtimes {leadtimes} not in {self.variable} run {self.run}")
+        if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+            return slice(positions[0], positions[0] + len(positions))
+        return positions
+
+
+_manifests: dict[str, tuple[int, dict]] = {}
+_runs: dict[str, StoreRun] = {}
+_lock = threading.Lock()
+
+
+def manifest_path(store_dir:str=STORE_DIR) -> Path:
+    return Path(store_dir) / MANIFEST_NAME
+
+
+def load_manifest(store_dir:str=STORE_DIR) -> dict:
+    """Manifest of the store, reread only when it changes on disk."""
+    path = manifest_path(store_dir)
+    if not path.exists():
+        return {"runs": {}, "grids": {}}
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _manifests.get(str(path))
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "r") as file:
+            manifest = json.load(file)
+        _manifests[str(path)] = (mtime, manifest)
+        return manifest
+
+
+def find_entry(manifest:dict, variable:str, run:datetime, model:Optional[str]=None) -> Optional[dict]:
+    """Manifest entry of a run. Without a model the ensemble is preferred and otherwise any model will do,
+    like catalog.Catalog.find."""
+    models = manifest["runs"].get(variable, {}).get(run.strftime(RUN_FORMAT), {})
+    if "file" in models: # NOTE: Ingested before the model was recorded, ingest it again
+        return None
+    if model is not None:
+        return models.get(model.upper())
+    return models.get(DEFAULT_MODEL) or next(iter(models.values()), None)
+
+
+def has_run(variable:str, run:datetime, model:Optional[str]=None, store_dir:str=STORE_DIR) -> bool:
+    return find_entry(load_manifest(store_dir), variable, run, model) is not None
+
+
+def open_run(variable:str, run:datetime, model:Optional[str]=None, store_dir:str=STORE_DIR) -> StoreRun:
+    """Memory-map an ingested run. Mapped pages live in the page cache and are shared between processes."""
+    manifest = load_manifest(store_dir)
+    entry = find_entry(manifest, variable, run, model)
+    if entry is None:
+        raise ValueError(f"No {variable} run {run} of {model=} in {store_dir}. Ingest it with: python forecast_store.py ingest <file.nc>")
+    path = str(Path(store_dir) / entry["file"])
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        store_run = _runs.get(path)
+        if store_run is None or store_run.mtime != mtime:
+            grid = manifest["grids"][entry["grid"]]
+            store_run = StoreRun(
+                variable=variable,
+                run=run,
+                model=entry["model"],
+                path=path,
+                mtime=mtime,
+                values=np.load(path, mmap_mode="r"),
+                leadtimes=entry["leadtimes"],
+                longitude=np.array(grid["longitude"], dtype=np.float64),
+                latitude=np.array(grid["latitude"], dtype=np.float64)
+            )
+            _runs[path] = store_run
+        return store_run
+
+
+def ingest(nc_path:str, run:datetime=None, store_dir:str=STORE_DIR, variables:list[str]=None, model:str=None) -> list[str]:
+    """Convert a downloaded CAMS NetCDF file into uncompressed (leadtime, lat, lon) float32 .npy arrays,
+    one per variable, and record their axes in the manifest. The model is read from the file name unless given.
+    Returns the ingested variables."""
+    model = (model or model_from_path(nc_path)).upper()
+    if run is None:
+        try:
+            run = run_from_path(nc_path)
+        except ValueError as e:
+            raise ValueError(f"{e}. Give it with --run") from e
+    run_key = run.strftime(RUN_FORMAT)
+    ingested = []
+    with xr.open_dataset(nc_path, engine="netcdf4", decode_timedelta=False) as ds:
+        longitude = ds.variables["longitude"].data.astype(np.float64).tolist()
+        latitude = ds.variables["latitude"].data.astype(np.float64).tolist()
+        grid_key = f"{len(latitude)}x{len(longitude)}_{latitude[0]:.3f}_{longitude[0]:.3f}"
+        leadtimes = time_hours(ds.variables["time"].values).tolist()
+
+        for variable, data in ds.data_vars.items():
+            if variables and variable not in variables: continue
+            if not {"time", "latitude", "longitude"}.issubset(data.dims): continue
+            if "level" in data.dims:
+                data = data.isel(level=0)
+            data = data.transpose("time", "latitude", "longitude")
+
+            file = f"{variable}/{model}/{run_key}.npy"
+            target = Path(store_dir) / file
+            target.parent.mkdir(parents=True, exist_ok=True)
+            partial = target.with_suffix(".npy.partial")
+            values = np.lib.format.open_memmap(partial, mode="w+", dtype=np.float32, shape=data.shape)
+            for position in range(data.shape[0]):
+                # NOTE: One leadtime at a time keeps memory bounded to a single (lat, lon) grid
+                values[position] = data.isel(time=position).values
+            values.flush()
+            del values
+            os.replace(partial, target)
+
+            _update_manifest(store_dir, variable, run_key, model, {
+                "file": file,
+                "model": model,
+                "grid": grid_key,
+                "leadtimes": leadtimes,
+                "source": str(nc_path)
+            }, grid_key, {"longitude": longitude, "latitude": latitude})
+            ingested.append(variable)
+    return ingested
+
+
+def _update_manifest(store_dir:str, variable:str, run_key:str, model:str, entry:dict, grid_key:str, grid:dict):
+    path = manifest_path(store_dir)
+    manifest = {"runs": {}, "grids": {}}
+    if path.exists():
+        with open(path, "r") as file:
+            manifest = json.load(file)
+    manifest["grids"][grid_key] = grid
+    runs = manifest["runs"].setdefault(variable, {})
+    models = runs.get(run_key, {})
+    runs[run_key] = {**(models if "file" not in models else {}), model: entry} # NOTE: Drops an entry without a model
+    # Write and rename so readers never see a half written manifest
+    partial = path.with_suffix(".json.partial")
+    with open(partial, "w") as file:
+        json.dump(manifest, file)
+    os.replace(partial, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert CAMS NetCDF forecasts into a memory-mappable store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="Ingest NetCDF files")
+    ingest_parser.add_argument("files", nargs="+")
+    ingest_parser.add_argument("--run", type=datetime.fromisoformat, help="Forecast run time, eg. 2025-05-10T00. Read from the path by default.")
+    ingest_parser.add_argument("--store", default=STORE_DIR)
+    ingest_parser.add_argument("--variable", action="append", dest="variables", help="NetCDF variable to ingest. Default is all.")
+    ingest_parser.add_argument("--model", help="Forecast model, eg. ENS. Read from the file name by default.")
+    args = parser.parse_args()
+
+    for nc_file in args.files:
+        variables = ingest(nc_file, run=args.run, store_dir=args.store, variables=args.variables, model=args.model)
+        print(f"Ingested {nc_file}: {', '.join(variables)}")
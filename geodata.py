@@ -1,20 +1,38 @@
 import os
 import json
 import glob
-import copy
-import sqlite3
+import functools
+import threading
+import multiprocessing
 import pandas as pd
-from dataclasses import dataclass
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
-from typing import TypeAlias, Literal, Optional
+from typing import TypeAlias, Literal, Optional, Iterator
 
 import numpy as np
 import xarray as xr
 
+import forecast_db
+import forecast_store
+import metrics
+from cache import LRUCache
+from catalog import catalog, netcdf_lock, time_hours, NC_VARIABLES
+
 
 GeoJSON: TypeAlias = dict[Literal["type", "center", "features", "limits"]]
 GeoJSONlimits: TypeAlias = dict[Literal["north", "south", "west", "east"]]
 
+# Pool of query_forecasts: "process", "thread" or "serial". Processes decode HDF5 in parallel, threads mostly do not.
+READ_EXECUTOR = os.environ.get("GEODATA_EXECUTOR", "process")
+READ_WORKERS = int(os.environ.get("GEODATA_WORKERS", os.cpu_count() or 1))
+
+ANALYSIS_CHUNK_HOURS = 24 # Hours decoded at once by iter_analysis_chunks, 24 Europe grids are ~28 MB
+
+# Decoded (lat, lon) slices keyed by (file, mtime, variable, leadtime, bbox). Sized for the 1 GB fly.io VM.
+slice_cache = LRUCache(max_bytes=int(os.environ.get("GEODATA_CACHE_MB", 128)) * 2**20)
+metrics.register_collector(lambda: metrics.cache_gauges("geodata_slices", slice_cache.stats()))
+
 @dataclass
 class ForecastQuery:
     variable: Literal['PM2.5'
@@ -73,7 +91,7 @@ class ForecastMultiQuery:
                     'Grass pollen'
                     'Mugwort pollen'
                     'Olive pollen'
-                    'Ragweed pollen']
+                    'Ragweed pollen']|list[str] # Several variables are read together, see query_forecast_variables
     time: datetime
     leadtimes: list[int] # 0 zero means at 00:00 o'clock tec.
     model: Optional[str]
@@ -108,105 +126,629 @@ class AnalysisQuery:
                     'Ragweed pollen']
     start_time: datetime
     end_time: datetime
+    model: Optional[str] = None
+    limits: Optional[GeoJSONlimits] = None
 
 
 
-def query_forecast_db(query:ForecastQuery):
-    leadtime = query.time + timedelta(hours=query.leadtimes)
-    with sqlite3.connect("AirQuality.db") as conn:
-        cursor = conn.cursor()
-        parameters = {
-            "variable": query.variable,
-            "datetime": query.time.strftime("%Y/%m/%d %H:%M"), 
-            "leadtime": leadtime.strftime("%Y/%m/%d %H:%M"), 
-            "model": query.model
-        }
-        if not query.model:
-            parameters.pop("model")
-            sql = f"""
-                SELECT variable_name, value, lon, lat, leadtime 
-                FROM forecasts 
-                WHERE variable_name=:variable AND datetime=:datetime AND leadtime<=:leadtime
-            """
-        else:
-            sql = f"""
-                SELECT variable_name, value, lon, lat, leadtime 
-                FROM forecasts 
-                WHERE variable_name=:variable AND datetime=:datetime AND leadtime<=:leadtime AND model=:model
-            """
-        results = cursor.execute(sql, parameters).fetchall()
-        df = pd.DataFrame(results, columns=["variable", "value", "lon", "lat", "leadtime"])
-        df['id'] = df.apply(lambda row: f"[{row['lon']}, {row['lat']}]", axis=1)
-        df = df[['id'] + [col for col in df.columns if col != 'id']]
-        return df
-
-
-def query_forecast_nc(query:ForecastQuery):
-    ds = xr.open_dataset("data/netcdf/cams-europe-air-quality-forecasts/EU-forecast-PM10-2025-05-10-24/ENS_FORECAST.nc", engine="netcdf4", decode_timedelta=False)
-    all_values = ds.variables["pm10_conc"][query.leadtimes][0].data # lat lon
-    all_longitudes = list(map(lambda lon: lon if lon < 180 else lon - 360, ds.variables["longitude"].data.tolist()))
-    all_latitudes:list = ds.variables["latitude"].data.tolist()
-
-    values = all_values
-    longitude = all_longitudes
-    latitude = all_latitudes
+@dataclass
+class CompactFrame:
+    """Forecast of one variable with every axis stored once: float32 (leadtime, lat, lon) values and integer
+    cell ids with a single id-string lookup for plotly. About 4 bytes per cell and leadtime, where the long-form
+    frame takes over 60. Long-form columns are built on access, df["value"], or all at once with frame."""
+    values: np.ndarray # (leadtime, lat, lon) float32
+    longitude: np.ndarray
+    latitude: np.ndarray # NOTE: descending order
+    leadtimes: np.ndarray # int64
+    variable: Optional[str] = None
+    time: Optional[datetime] = None
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.longitude.nbytes + self.latitude.nbytes + self.leadtimes.nbytes
+
+    def __len__(self) -> int:
+        return self.values.size
+
+    @functools.cached_property
+    def id_strings(self) -> np.ndarray:
+        """Plotly id "[lon, lat]" of every cell, indexed by cell id."""
+        return grid_ids(self.longitude, self.latitude).ravel()
+
+    def cell_ids(self) -> np.ndarray:
+        """Cell ids lat_index * n_lon + lon_index of one leadtime, in row order."""
+        _, n_lat, n_lon = self.shape
+        return np.arange(n_lat * n_lon, dtype=np.int32)
+
+    def __getitem__(self, column:str) -> np.ndarray:
+        """Column of the long-form frame, rows ordered by leadtime, then lat, then lon."""
+        n_time, n_lat, n_lon = self.shape
+        if column == "value": return self.values.reshape(-1) # NOTE: float32, a view
+        if column == "cell": return np.tile(self.cell_ids(), n_time)
+        if column == "id": return np.tile(self.id_strings, n_time)
+        if column == "lon": return np.tile(self.longitude, n_lat * n_time)
+        if column == "lat": return np.tile(np.repeat(self.latitude, n_lon), n_time)
+        if column == "leadtime": return np.repeat(self.leadtimes.astype(np.float64), n_lat * n_lon)
+        raise KeyError(column)
+
+    @functools.cached_property
+    def frame(self) -> pd.DataFrame:
+        """Long-form (id, value, lon, lat, leadtime) frame as returned by query_forecast, built on first use."""
+        return forecast_frame(self.values, self.longitude, self.latitude, self.leadtimes.tolist())
+
+    def to_dataarray(self) -> xr.DataArray:
+        """(leadtime, lat, lon) xr.DataArray sharing the values."""
+        return xr.DataArray(
+            self.values,
+            dims=("leadtime", "lat", "lon"),
+            coords={"leadtime": self.leadtimes, "lat": self.latitude, "lon": self.longitude},
+            name=self.variable,
+            attrs={"time": self.time} if self.time else {}
+        )
+
+
+@metrics.timed("geodata.query_db")
+def query_forecast_db(query:ForecastQuery|ForecastMultiQuery, db_path:str=forecast_db.DB_PATH, compact:bool=False) -> pd.DataFrame|CompactFrame:
+    """Forecast values from the SQLite backend (see forecast_db.py). Leadtimes and limits are filtered in SQL
+    and rows are decoded straight into numpy columns. An int leadtime means every hour up to it.
+    compact=True grids the rows into a CompactFrame, cells without a row are NaN."""
+    conditions = ["variable_name=:variable", "datetime=:datetime"]
+    parameters = {
+        "variable": query.variable,
+        "datetime": query.time.strftime(forecast_db.DATETIME_FORMAT)
+    }
+    if isinstance(query.leadtimes, list):
+        placeholders = []
+        for i, hour in enumerate(query.leadtimes):
+            parameters[f"leadtime{i}"] = (query.time + timedelta(hours=hour)).strftime(forecast_db.DATETIME_FORMAT)
+            placeholders.append(f":leadtime{i}")
+        conditions.append(f"leadtime IN ({', '.join(placeholders)})")
+    else:
+        parameters["leadtime"] = (query.time + timedelta(hours=query.leadtimes)).strftime(forecast_db.DATETIME_FORMAT)
+        conditions.append("leadtime<=:leadtime")
+    if query.model:
+        parameters["model"] = query.model
+        conditions.append("model=:model")
     if query.limits:
-        # Find longitude index range
-        west_limit_idx = min([i for i, lon in enumerate(all_longitudes) if lon > query.limits["west"]])
-        east_limit_idx = max([i for i, lon in enumerate(all_longitudes) if lon < query.limits["east"]])
-
-        # Find latitude index range (NOTE: descending order)
-        north_limit_idx = min([i for i, lat in enumerate(all_latitudes) if lat < query.limits["north"]])
-        south_limit_idx = max([i for i, lat in enumerate(all_latitudes) if lat > query.limits["south"]])
+        parameters.update({side: query.limits[side] for side in ("north", "south", "west", "east")})
+        conditions += ["lon>:west", "lon<:east", "lat<:north", "lat>:south"]
+
+    sql = f"""
+        SELECT value, lon, lat,
+            round((julianday(replace(leadtime, '/', '-')) - julianday(replace(datetime, '/', '-'))) * 24) AS hours
+        FROM forecasts
+        WHERE {" AND ".join(conditions)}
+        ORDER BY leadtime, lat DESC, lon
+    """
+    cursor = forecast_db.connect(db_path).execute(sql, parameters)
+    rows = np.fromiter(cursor, dtype=[("value", np.float64), ("lon", np.float64), ("lat", np.float64), ("leadtime", np.float64)])
+    if compact:
+        values, longitude, latitude, leadtimes = points_to_grid(rows["lon"], rows["lat"], rows["leadtime"], rows["value"], dtype=np.float32)
+        return CompactFrame(values, longitude, latitude, leadtimes, query.variable, query.time)
+
+    df = pd.DataFrame({
+        "id": point_ids(rows["lon"], rows["lat"]), # Create id for plotly
+        "variable": np.full(len(rows), query.variable, dtype=object),
+        "value": rows["value"],
+        "lon": rows["lon"],
+        "lat": rows["lat"],
+        "leadtime": rows["leadtime"]
+    })
+    return df
 
-        # Crop the 1D coordinate arrays
-        longitude = all_longitudes[west_limit_idx:east_limit_idx + 1]
-        latitude = all_latitudes[north_limit_idx:south_limit_idx + 1]
 
-        # Crop the 2D values array using lat (rows) and lon (columns)
-        values = all_values[north_limit_idx:south_limit_idx + 1, west_limit_idx:east_limit_idx + 1]
+@dataclass
+class DatasetHandle:
+    path: str
+    mtime: int
+    dataset: xr.Dataset
+    longitude: np.ndarray # -180..180
+    latitude: np.ndarray # NOTE: descending order
+    hours: list[int] # Leadtime hour of each step of the time axis, see catalog.time_hours
+
+    def positions(self, leadtimes:list[int]) -> list[int]:
+        """Index of leadtimes on the time axis, which may not start at 0 or may have gaps."""
+        position = {hour: k for k, hour in enumerate(self.hours)}
+        try:
+            return [position[leadtime] for leadtime in leadtimes]
+        except KeyError:
+            raise ValueError(f"Leadtimes {leadtimes} not in {self.path}, it has {self.hours}")
+
+
+_datasets: dict[str, DatasetHandle] = {}
+_datasets_lock = threading.Lock()
+_inherited: list[DatasetHandle] = []
+
+
+def _forget_datasets():
+    """Start a forked child with an empty registry. The inherited handles share HDF5 state with the parent and are
+    never used or closed here. NOTE: A fork during a build may copy _datasets_lock held by another thread."""
+    global _datasets, _datasets_lock
+    _inherited.extend(_datasets.values())
+    _datasets, _datasets_lock = {}, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_datasets)
+
+
+def open_forecast_dataset(path:str) -> DatasetHandle:
+    """Return the process-wide handle of a NetCDF file. The file is reopened only when it changes on disk."""
+    mtime = os.stat(path).st_mtime_ns
+    with _datasets_lock:
+        handle = _datasets.get(path)
+        if handle and handle.mtime == mtime:
+            return handle
+        if handle:
+            with netcdf_lock:
+                handle.dataset.close()
+        handle = load_dataset(path, mtime)
+        _datasets[path] = handle
+        return handle
+
+
+def load_dataset(path:str, mtime:Optional[int]=None) -> DatasetHandle:
+    """Open a NetCDF file outside the registry, the caller closes handle.dataset."""
+    with netcdf_lock:
+        with metrics.timer("geodata.open"):
+            ds = xr.open_dataset(path, engine="netcdf4", decode_timedelta=False)
+        return DatasetHandle(
+            path=path,
+            mtime=os.stat(path).st_mtime_ns if mtime is None else mtime,
+            dataset=ds,
+            longitude=longitude_180(ds.variables["longitude"].data),
+            latitude=ds.variables["latitude"].data.astype(np.float64),
+            hours=time_hours(ds.variables["time"].values).tolist()
+        )
+
+
+def close_dataset(path:str):
+    """Close the NetCDF handle of path if it is open, eg. once a refresh has replaced its run."""
+    with _datasets_lock:
+        handle = _datasets.pop(path, None)
+        if handle:
+            with netcdf_lock:
+                handle.dataset.close()
+
+
+def close_run(variable:str, time:datetime):
+    """Close the NetCDF handles of every model of a run, eg. once a refresh has replaced it."""
+    for (entry_variable, run, _), entry in list(catalog.entries.items()):
+        if entry_variable == variable and run == time:
+            close_dataset(entry.path)
+
+
+def close_datasets():
+    """Close every NetCDF handle, eg. before forking workers. Decoded slices stay in slice_cache."""
+    with _datasets_lock, netcdf_lock:
+        for handle in _datasets.values():
+            handle.dataset.close()
+        _datasets.clear()
+
+
+def cache_stats() -> dict:
+    return {"datasets_open": len(_datasets), **slice_cache.stats()}
+
+
+def longitude_180(longitude:np.ndarray) -> np.ndarray:
+    """CAMS longitudes run 335..360, 0..45. Shift them to -180..180 so they are ascending."""
+    longitude = longitude.astype(np.float64)
+    return np.where(longitude < 180, longitude, longitude - 360)
+
+
+@metrics.timed("geodata.crop")
+def crop_slices(longitude:np.ndarray, latitude:np.ndarray, limits:Optional[GeoJSONlimits]) -> tuple[slice, slice]:
+    """Index ranges (lat, lon) of the grid cells strictly inside limits."""
+    if not limits:
+        return slice(0, len(latitude)), slice(0, len(longitude))
+
+    # Find longitude index range
+    west_limit_idx = int(np.searchsorted(longitude, limits["west"], side="right"))
+    east_limit_idx = int(np.searchsorted(longitude, limits["east"], side="left"))
+
+    # Find latitude index range (NOTE: descending order, so search the reversed axis)
+    n_lat = len(latitude)
+    north_limit_idx = n_lat - int(np.searchsorted(latitude[::-1], limits["north"], side="left"))
+    south_limit_idx = n_lat - int(np.searchsorted(latitude[::-1], limits["south"], side="right"))
+
+    if west_limit_idx >= east_limit_idx or north_limit_idx >= south_limit_idx:
+        raise ValueError(f"No grid cells within limits {limits}")
+    return slice(north_limit_idx, south_limit_idx), slice(west_limit_idx, east_limit_idx)
+
+
+def read_forecast_block(handle:DatasetHandle, variable:str, leadtimes:list[int], lat_slice:slice, lon_slice:slice) -> np.ndarray:
+    """Decoded (leadtime, lat, lon) values. Leadtimes missing from slice_cache are read with a single indexed read."""
+    crop = (lat_slice.start, lat_slice.stop, lon_slice.start, lon_slice.stop)
+    slices = {leadtime: slice_cache.get((handle.path, handle.mtime, variable, leadtime, *crop)) for leadtime in leadtimes}
+    missing = [leadtime for leadtime, values in slices.items() if values is None]
+    if missing:
+        # NOTE: cropping before .values decompresses only the chunks inside the bbox
+        with netcdf_lock, metrics.timer("geodata.decode"):
+            block = handle.dataset[variable].isel(time=handle.positions(missing), level=0, latitude=lat_slice, longitude=lon_slice).values
+        for leadtime, values in zip(missing, block):
+            # NOTE: A copy, a view would keep the whole block alive while the cache charges only the slice
+            values = values.copy()
+            values.flags.writeable = False # Shared between callers
+            slices[leadtime] = values
+            slice_cache.put((handle.path, handle.mtime, variable, leadtime, *crop), values)
+        if len(missing) == len(leadtimes) == len(slices):
+            block.flags.writeable = False
+            return block
+    return np.stack([slices[leadtime] for leadtime in leadtimes])
+
+
+def nc_variable(variable:str) -> str:
+    return NC_VARIABLES.get(variable, variable)
+
+
+def query_forecast(query:ForecastQuery|ForecastMultiQuery, as_array:bool=False, compact:bool=False) -> pd.DataFrame|xr.DataArray|xr.Dataset|CompactFrame:
+    """Read from the memory-mapped store when the run has been ingested, otherwise from NetCDF.
+    A list of variables is read with query_forecast_variables. compact=True returns a CompactFrame."""
+    if isinstance(query.variable, list):
+        if compact:
+            raise ValueError("A CompactFrame holds one variable, use as_array=True for several")
+        return query_forecast_variables(query, as_array)
+    if forecast_store.has_run(nc_variable(query.variable), query.time, query.model):
+        return query_forecast_store(query, as_array, compact)
+    return query_forecast_nc(query, as_array, compact=compact)
+
+
+def forecast_source(variable:str, time:datetime, model:Optional[str]=None) -> str:
+    """File that query_forecast reads for variable and run time."""
+    if forecast_store.has_run(nc_variable(variable), time, model):
+        return forecast_store.open_run(nc_variable(variable), time, model).path
+    return catalog.lookup(variable, time, model).path
+
+
+def forecast_leadtimes(variable:str, time:datetime, model:Optional[str]=None) -> list[int]:
+    """Every leadtime hour available for variable and run time."""
+    if forecast_store.has_run(nc_variable(variable), time, model):
+        return list(forecast_store.open_run(nc_variable(variable), time, model).leadtimes)
+    return list(catalog.lookup(variable, time, model).leadtimes)
+
+
+def query_forecast_store(query:ForecastQuery|ForecastMultiQuery, as_array:bool=False, compact:bool=False) -> pd.DataFrame|xr.DataArray|CompactFrame:
+    """Like query_forecast_nc but reads np.memmap slices of an ingested run (see forecast_store.py).
+    Consecutive leadtimes are a zero-copy view of the mapped file."""
+    leadtimes = query.leadtimes if isinstance(query.leadtimes, list) else [query.leadtimes]
+    run = forecast_store.open_run(nc_variable(query.variable), query.time, query.model)
+    longitude = longitude_180(run.longitude)
+    lat_slice, lon_slice = crop_slices(longitude, run.latitude, query.limits)
+    values = run.values[run.positions(leadtimes), lat_slice, lon_slice]
+    return forecast_result(query, values, longitude[lon_slice], run.latitude[lat_slice], leadtimes, as_array, compact)
+
+
+def query_forecast_nc(query:ForecastQuery|ForecastMultiQuery, as_array:bool=False, path:Optional[str]=None, compact:bool=False) -> pd.DataFrame|xr.DataArray|CompactFrame:
+    """Forecast values inside query.limits for every requested leadtime, read in one pass.
+    The file is looked up in the catalog unless path is given.
+    With as_array=True returns the (leadtime, lat, lon) xr.DataArray and skips building the long-form frame,
+    with compact=True a CompactFrame."""
+    leadtimes = query.leadtimes if isinstance(query.leadtimes, list) else [query.leadtimes]
+    if path is None:
+        entry = catalog.lookup(query.variable, query.time, query.model)
+        path, variable = entry.path, entry.nc_variable
+    else:
+        variable = nc_variable(query.variable)
+    handle = open_forecast_dataset(path)
+    lat_slice, lon_slice = crop_slices(handle.longitude, handle.latitude, query.limits)
+    values = read_forecast_block(handle, variable, leadtimes, lat_slice, lon_slice)
+    return forecast_result(query, values, handle.longitude[lon_slice], handle.latitude[lat_slice], leadtimes, as_array, compact)
+
+
+def query_forecast_variables(query:ForecastMultiQuery, as_array:bool=False) -> pd.DataFrame|xr.Dataset:
+    """Several variables of one run. Variables in the same NetCDF file share one dataset handle and one crop,
+    so eg. PM2.5, NO2 and O3 downloaded together cost a single open instead of three.
+    Returns an xr.Dataset of (leadtime, lat, lon) arrays, or a long-form frame with a variable column
+    ordered by variable in query order, then leadtime, lat and lon."""
+    leadtimes = query.leadtimes if isinstance(query.leadtimes, list) else [query.leadtimes]
+    arrays = {}
+    files: dict[str, list] = {}
+    for variable in query.variable:
+        if forecast_store.has_run(nc_variable(variable), query.time, query.model):
+            arrays[variable] = query_forecast_store(replace(query, variable=variable), as_array=True)
+        else:
+            entry = catalog.lookup(variable, query.time, query.model)
+            files.setdefault(entry.path, []).append(entry)
+
+    for path, entries in files.items():
+        handle = open_forecast_dataset(path)
+        lat_slice, lon_slice = crop_slices(handle.longitude, handle.latitude, query.limits)
+        for entry in entries:
+            values = read_forecast_block(handle, entry.nc_variable, leadtimes, lat_slice, lon_slice)
+            arrays[entry.variable] = forecast_result(replace(query, variable=entry.variable), values, handle.longitude[lon_slice], handle.latitude[lat_slice], leadtimes, as_array=True)
+
+    return combine_variables(query, arrays, leadtimes, as_array)
+
+
+def combine_variables(query:ForecastMultiQuery, arrays:dict[str, xr.DataArray], leadtimes:list[int], as_array:bool) -> pd.DataFrame|xr.Dataset:
+    if as_array:
+        return xr.Dataset({variable: arrays[variable] for variable in query.variable}, attrs={"time": query.time})
+    frames = []
+    for variable in query.variable:
+        array = arrays[variable]
+        df = forecast_frame(array.values, array["lon"].values, array["lat"].values, leadtimes)
+        df.insert(1, "variable", variable)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+_executors: dict[tuple, Executor] = {}
+_executors_lock = threading.Lock()
+
+
+def read_executor(kind:Literal["process", "thread", "serial"]=READ_EXECUTOR, workers:int=READ_WORKERS) -> Optional[Executor]:
+    """Shared pool of query_forecasts, created on first use. None means read in the calling thread.
+    NOTE: Keyed by pid too, a pool must not cross a fork (gunicorn workers)."""
+    if kind == "serial" or workers <= 1:
+        return None
+    key = (os.getpid(), kind, workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if kind == "process":
+                # NOTE: spawn, forked children would inherit open HDF5 handles and its locks
+                executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            elif kind == "thread":
+                executor = ThreadPoolExecutor(workers, thread_name_prefix="geodata-read")
+            else:
+                raise ValueError(f"Unknown executor {kind=}, use process, thread or serial")
+            _executors[key] = executor
+        return executor
+
+
+def close_executors():
+    with _executors_lock:
+        for key in [key for key in _executors if key[0] == os.getpid()]:
+            _executors.pop(key).shutdown(cancel_futures=True)
+
+
+def read_query_block(query:ForecastMultiQuery) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(values, lon, lat) of a single variable query. Runs in pool workers: plain arrays pickle cheaply,
+    frames are built by the caller."""
+    array = query_forecast(query, as_array=True)
+    return np.asarray(array.values), array["lon"].values, array["lat"].values
+
+
+@metrics.timed("geodata.query_forecasts")
+def query_forecasts(queries:list[ForecastMultiQuery], as_array:bool=False, kind:Literal["process", "thread", "serial"]=READ_EXECUTOR, workers:int=READ_WORKERS) -> list[pd.DataFrame|xr.DataArray|xr.Dataset]:
+    """Many runs, models or variables at once. Every (query, variable) pair is read by its own pool task
+    (see read_executor), results are in the order of queries whatever order the tasks finish in."""
+    tasks = [
+        replace(query, variable=variable)
+        for query in queries
+        for variable in (query.variable if isinstance(query.variable, list) else [query.variable])
+    ]
+    executor = read_executor(kind, workers) if len(tasks) > 1 else None
+    blocks = iter(executor.map(read_query_block, tasks) if executor else map(read_query_block, tasks))
+
+    results = []
+    for query in queries:
+        leadtimes = query.leadtimes if isinstance(query.leadtimes, list) else [query.leadtimes]
+        if not isinstance(query.variable, list):
+            values, longitude, latitude = next(blocks)
+            results.append(forecast_result(query, values, longitude, latitude, leadtimes, as_array))
+            continue
+        arrays = {}
+        for variable in query.variable:
+            values, longitude, latitude = next(blocks)
+            arrays[variable] = forecast_result(replace(query, variable=variable), values, longitude, latitude, leadtimes, as_array=True)
+        results.append(combine_variables(query, arrays, leadtimes, as_array))
+    return results
+
+
+def forecast_result(query:ForecastQuery|ForecastMultiQuery, values:np.ndarray, longitude:np.ndarray, latitude:np.ndarray, leadtimes:list[int], as_array:bool, compact:bool=False) -> pd.DataFrame|xr.DataArray|CompactFrame:
+    longitude = rounded_axis(longitude)
+    latitude = rounded_axis(latitude)
+    if compact:
+        return CompactFrame(np.asarray(values, dtype=np.float32), longitude, latitude, np.asarray(leadtimes, dtype=np.int64), query.variable, query.time)
+    if as_array:
+        return xr.DataArray(
+            values,
+            dims=("leadtime", "lat", "lon"),
+            coords={"leadtime": leadtimes, "lat": latitude, "lon": longitude},
+            name=query.variable,
+            attrs={"time": query.time}
+        )
+    return forecast_frame(values, longitude, latitude, leadtimes)
+
+
+def rounded_axis(axis:np.ndarray) -> np.ndarray:
+    # NOTE: Python round on the 1D axis keeps coordinates identical to the old per-cell rounding
+    return np.array([round(value, 2) for value in axis.tolist()], dtype=np.float64)
+
+
+@metrics.timed("geodata.frame")
+def forecast_frame(values:np.ndarray, longitude:np.ndarray, latitude:np.ndarray, leadtimes:list[int]) -> pd.DataFrame:
+    """Long-form frame (id, value, lon, lat, leadtime) of a (leadtime, lat, lon) array.
+    Rows are ordered by leadtime, then lat, then lon, so no sorting is needed."""
+    n_time, n_lat, n_lon = values.shape
+    n_cells = n_lat * n_lon
+
+    df = pd.DataFrame({
+        "id": np.tile(grid_ids(longitude, latitude).ravel(), n_time), # Create id for plotly
+        "value": np.asarray(values, dtype=np.float64).ravel(),
+        "lon": np.tile(longitude, n_lat * n_time),
+        "lat": np.tile(np.repeat(latitude, n_lon), n_time),
+        "leadtime": np.repeat(np.asarray(leadtimes, dtype=np.float64), n_cells)
+    })
+    return df
 
-    # Create coordinate matrix
-    LON, LAT = np.meshgrid(longitude, latitude)
-    matrix_np = np.stack((LON, LAT), axis=-1)
-    coordinates = [[[round(lat[0],2), round(lat[1],2)] for lat in lon] for lon in matrix_np.tolist()] 
 
-    values_expanded = values[:, :, np.newaxis] # Make it 3D so we can concatenate it
+def points_to_grid(longitude:np.ndarray, latitude:np.ndarray, leadtime:np.ndarray, value:np.ndarray, dtype=np.float64) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(leadtime, lat, lon) values and the lon, lat and leadtime axes of scattered points in any order.
+    Cells without a point are NaN."""
+    lon_axis = np.unique(longitude)
+    lat_axis = np.unique(latitude)[::-1] # NOTE: descending order like the NetCDF files
+    leadtimes = np.unique(leadtime).astype(np.int64)
+    values = np.full((len(leadtimes), len(lat_axis), len(lon_axis)), np.nan, dtype=dtype)
+    values[
+        np.searchsorted(leadtimes, leadtime),
+        len(lat_axis) - 1 - np.searchsorted(lat_axis[::-1], latitude),
+        np.searchsorted(lon_axis, longitude)
+    ] = value
+    return values, lon_axis, lat_axis, leadtimes
 
-    # Add values to coordinates
-    results = np.concatenate((values_expanded, coordinates), axis=2)
 
-    # Add leadtime to coordinates
-    time_array = np.full((len(latitude), len(longitude), 1), query.leadtimes)
-    results = np.concatenate((results, time_array), axis=2)
+def frame_to_dataarray(df:pd.DataFrame) -> xr.DataArray:
+    """(leadtime, lat, lon) array of a long-form frame in any row order. Cells missing from the frame are NaN."""
+    values, longitude, latitude, leadtimes = points_to_grid(df["lon"].to_numpy(), df["lat"].to_numpy(), df["leadtime"].to_numpy(), df["value"].to_numpy())
+    return xr.DataArray(values, dims=("leadtime", "lat", "lon"), coords={"leadtime": leadtimes, "lat": latitude, "lon": longitude})
 
-    # Reshape results for pd.DataFrame
-    flat_result = results.reshape(-1, 4) #2D
 
-    df = pd.DataFrame(flat_result, columns=["value", "lon", "lat", "leadtime"])
+def grid_ids(longitude:np.ndarray, latitude:np.ndarray) -> np.ndarray:
+    """(lat, lon) array of plotly ids "[lon, lat]". Only the axes are formatted in Python."""
+    lon_str = np.array([f"[{lon}, " for lon in longitude.tolist()])
+    lat_str = np.array([f"{lat}]" for lat in latitude.tolist()])
+    return np.char.add(lon_str[np.newaxis, :], lat_str[:, np.newaxis])
 
-    # Create id for plotly
-    df['id'] = df.apply(lambda row: f"[{row['lon']}, {row['lat']}]", axis=1)
 
-    # Move id-column to first
-    df = df[['id'] + [col for col in df.columns if col != 'id']]
-    return df
+def point_ids(longitude:np.ndarray, latitude:np.ndarray) -> np.ndarray:
+    """Plotly ids "[lon, lat]" of scattered points. Each distinct coordinate is formatted once."""
+    lon_values, lon_inverse = np.unique(longitude, return_inverse=True)
+    lat_values, lat_inverse = np.unique(latitude, return_inverse=True)
+    lon_str = np.array([f"[{lon}, " for lon in lon_values.tolist()], dtype=str)
+    lat_str = np.array([f"{lat}]" for lat in lat_values.tolist()], dtype=str)
+    return np.char.add(lon_str[lon_inverse], lat_str[lat_inverse])
 
 
-def query_analysis(query:AnalysisQuery):
-    pass
+@dataclass
+class AnalysisChunk:
+    """Consecutive hours of one analysis file, cropped to the query limits."""
+    variable: str
+    times: np.ndarray # datetime64[h], valid time of each hour
+    values: np.ndarray # (time, lat, lon)
+    longitude: np.ndarray # -180..180
+    latitude: np.ndarray # NOTE: descending order
+
+
+def iter_analysis_chunks(query:AnalysisQuery, chunk_hours:int=ANALYSIS_CHUNK_HOURS) -> Iterator[AnalysisChunk]:
+    """Hourly analysis values from query.start_time until query.end_time, at most chunk_hours at a time.
+    Chunks bypass slice_cache and only the current one and the current file are held open, so memory does not
+    grow with the period.
+    Hours present in several files are emitted once, from the oldest file."""
+    entries = catalog.analysis_files(query.variable, query.start_time, query.end_time, query.model)
+    if not entries:
+        raise ValueError(f"No {query.variable} analysis files between {query.start_time} and {query.end_time} under {catalog.root}")
+    start = np.datetime64(query.start_time, "h")
+    end = np.datetime64(query.end_time, "h")
+    emitted_until = start - np.timedelta64(1, "h")
+
+    for entry in entries:
+        # NOTE: Not registered in _datasets, a year of files would keep a year of HDF5 chunk caches open
+        handle = load_dataset(entry.path)
+        try:
+            data = handle.dataset[entry.nc_variable]
+            lat_slice, lon_slice = crop_slices(handle.longitude, handle.latitude, query.limits)
+            with netcdf_lock:
+                time = handle.dataset["time"].values
+            if np.issubdtype(time.dtype, np.datetime64):
+                times = time.astype("datetime64[h]")
+            else:
+                times = np.datetime64(entry.run, "h") + time_hours(time).astype("timedelta64[h]")
+            positions = np.flatnonzero((times > emitted_until) & (times < end))
+
+            for first in range(0, len(positions), chunk_hours):
+                block = positions[first:first + chunk_hours]
+                selection = {"latitude": lat_slice, "longitude": lon_slice}
+                # NOTE: Consecutive hours as a slice is one hyperslab read instead of a fancy index
+                selection["time"] = slice(block[0], block[-1] + 1) if block[-1] - block[0] == len(block) - 1 else block
+                if "level" in data.dims:
+                    selection["level"] = 0
+                with netcdf_lock, metrics.timer("geodata.analysis_decode"):
+                    values = data.isel(selection).transpose("time", "latitude", "longitude").values
+                yield AnalysisChunk(entry.variable, times[block], values, handle.longitude[lon_slice], handle.latitude[lat_slice])
+            if len(positions):
+                emitted_until = times[positions[-1]]
+        finally:
+            with netcdf_lock:
+                handle.dataset.close()
 
 
-def get_dataframe(query:ForecastMultiQuery|AnalysisQuery):
+@dataclass
+class AnalysisAggregate:
+    """Running per-cell statistics over analysis chunks. Holds a few (lat, lon) grids however long the period."""
+    longitude: np.ndarray
+    latitude: np.ndarray
+    hours: np.ndarray # (lat, lon) hours with data
+    total: np.ndarray # (lat, lon) sum of hourly values
+    maximum: np.ndarray # (lat, lon), NaN where no data
+    start: Optional[np.datetime64] = None
+    end: Optional[np.datetime64] = None # Last hour seen
+
+    @classmethod
+    def empty(cls, longitude:np.ndarray, latitude:np.ndarray) -> "AnalysisAggregate":
+        shape = (len(latitude), len(longitude))
+        return cls(longitude, latitude, np.zeros(shape, dtype=np.int64), np.zeros(shape), np.full(shape, np.nan))
+
+    def update(self, chunk:AnalysisChunk) -> "AnalysisAggregate":
+        if chunk.values.shape[1:] != self.hours.shape:
+            raise ValueError(f"Analysis grid changed from {self.hours.shape} to {chunk.values.shape[1:]}")
+        values = np.asarray(chunk.values, dtype=np.float64)
+        valid = np.isfinite(values)
+        self.hours += valid.sum(axis=0)
+        self.total += np.where(valid, values, 0).sum(axis=0)
+        self.maximum = np.fmax(self.maximum, np.fmax.reduce(values, axis=0)) # fmax skips NaN without warnings
+        self.start = chunk.times[0] if self.start is None else self.start
+        self.end = chunk.times[-1]
+        return self
+
+    @property
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.hours > 0, self.total / self.hours, np.nan)
+
+    @property
+    def exposure(self) -> np.ndarray:
+        """Pollutant-minutes per m³ of air, multiply by air intake in m³ per minute for the inhaled amount
+        (see pollution.accumulation_intervals)."""
+        return self.total * 60
+
+    def to_dataset(self, variable:str) -> xr.Dataset:
+        coords = {"lat": rounded_axis(self.latitude), "lon": rounded_axis(self.longitude)}
+        dims = ("lat", "lon")
+        return xr.Dataset({
+            "hours": (dims, self.hours),
+            "mean": (dims, self.mean),
+            "max": (dims, self.maximum),
+            "sum": (dims, self.total),
+            "exposure": (dims, self.exposure)
+        }, coords=coords, attrs={"variable": variable, "start": str(self.start), "end": str(self.end)})
+
+
+@metrics.timed("geodata.query_analysis")
+def query_analysis(query:AnalysisQuery, as_array:bool=False, chunk_hours:int=ANALYSIS_CHUNK_HOURS) -> pd.DataFrame|xr.Dataset:
+    """Per-cell hours, mean, max, sum and exposure of the analysis between query.start_time and end_time,
+    aggregated chunk by chunk (see iter_analysis_chunks) so a year of hourly grids fits on the smallest VM.
+    Returns an xr.Dataset of (lat, lon) arrays, or a frame (id, lon, lat, hours, mean, max, sum, exposure)
+    ordered by lat, then lon."""
+    aggregate = None
+    for chunk in iter_analysis_chunks(query, chunk_hours):
+        aggregate = aggregate or AnalysisAggregate.empty(chunk.longitude, chunk.latitude)
+        aggregate.update(chunk)
+    if aggregate is None:
+        raise ValueError(f"No {query.variable} analysis hours between {query.start_time} and {query.end_time}")
+
+    dataset = aggregate.to_dataset(query.variable)
+    if as_array:
+        return dataset
+    longitude, latitude = dataset["lon"].values, dataset["lat"].values
+    return pd.DataFrame({
+        "id": grid_ids(longitude, latitude).ravel(),
+        "lon": np.tile(longitude, len(latitude)),
+        "lat": np.repeat(latitude, len(longitude)),
+        **{name: dataset[name].values.ravel() for name in ("hours", "mean", "max", "sum", "exposure")}
+    })
+
+
+def get_dataframe(query:ForecastMultiQuery|AnalysisQuery|list[ForecastMultiQuery]):
+    """A list of forecast queries is read in parallel, see query_forecasts."""
+    if isinstance(query, list):
+        return query_forecasts(query)
     if isinstance(query, ForecastMultiQuery):
-        _query:ForecastQuery = copy.deepcopy(query)
-        dfs = []
-        for hour in query.leadtimes:
-            _query.leadtimes = hour
-            dfs.append(query_forecast_nc(_query))
-        df = pd.concat(dfs, ignore_index=True)
-        df = df.sort_values(by="leadtime", ascending=True)
-        return df
+        return query_forecast(query)
     elif isinstance(query, AnalysisQuery):
         return query_analysis(query)
     raise ValueError(f"Query must be instance of either {ForecastMultiQuery.__name__} or {AnalysisQuery.__name__}")
@@ -0,0 +1,93 @@
+from typing import Iterable, Literal
+
+import numpy as np
+import xarray as xr
+
+
+# NOTE: geodata.rounded_axis rounds coordinates to 2 decimals, so steps between rounded cells are off by up to 0.01
+AXIS_TOLERANCE = 0.01 + 1e-6
+
+
+class GridIndex:
+    """Index of a regular lon/lat grid such as the CAMS 0.1° Europe grid.
+    Locations map to (i, j) = (lat row, lon column) with arithmetic, so a lookup is O(1)
+    per location no matter how many cells or leadtimes the data has."""
+
+    def __init__(self, longitude:np.ndarray, latitude:np.ndarray):
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.latitude = np.asarray(latitude, dtype=np.float64) # NOTE: descending order
+        self.lon_step = self._step(self.longitude, "longitude")
+        self.lat_step = self._step(self.latitude, "latitude") # Negative for descending axis
+
+    @staticmethod
+    def _step(axis:np.ndarray, name:str) -> float:
+        if len(axis) < 2: return 1.0
+        step = (axis[-1] - axis[0]) / (len(axis) - 1)
+        if not np.allclose(np.diff(axis), step, atol=AXIS_TOLERANCE):
+            raise ValueError(f"{name} axis is not regular")
+        return float(step)
+
+    @classmethod
+    def from_dataarray(cls, array:xr.DataArray) -> "GridIndex":
+        return cls(array["lon"].values, array["lat"].values)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.latitude), len(self.longitude)
+
+    def _fractional(self, lon:np.ndarray, lat:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        rows = (np.asarray(lat, dtype=np.float64) - self.latitude[0]) / self.lat_step
+        columns = (np.asarray(lon, dtype=np.float64) - self.longitude[0]) / self.lon_step
+        return rows, columns
+
+    def contains(self, lon:np.ndarray, lat:np.ndarray) -> np.ndarray:
+        """Mask of the locations that nearest and bilinear accept."""
+        rows, columns = self._fractional(lon, lat)
+        n_lat, n_lon = self.shape
+        # NOTE: half a cell of slack, the same area the nearest cell covers
+        return (rows >= -0.5) & (rows <= n_lat - 0.5) & (columns >= -0.5) & (columns <= n_lon - 0.5)
+
+    def _positions(self, lon:np.ndarray, lat:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Fractional (row, column) of each location."""
+        if not np.all(self.contains(lon, lat)):
+            raise ValueError("No data within exposure area")
+        return self._fractional(lon, lat)
+
+    def nearest(self, lon:np.ndarray, lat:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(i, j) indices of the cells nearest to each location."""
+        rows, columns = self._positions(lon, lat)
+        n_lat, n_lon = self.shape
+        i = np.clip(np.rint(rows).astype(np.int64), 0, n_lat - 1)
+        j = np.clip(np.rint(columns).astype(np.int64), 0, n_lon - 1)
+        return i, j
+
+    def bilinear(self, lon:np.ndarray, lat:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Upper-left (i, j) of the four cells around each location and the fractional distances to them."""
+        rows, columns = self._positions(lon, lat)
+        n_lat, n_lon = self.shape
+        rows = np.clip(rows, 0, n_lat - 1)
+        columns = np.clip(columns, 0, n_lon - 1)
+        i = np.clip(np.floor(rows).astype(np.int64), 0, max(n_lat - 2, 0))
+        j = np.clip(np.floor(columns).astype(np.int64), 0, max(n_lon - 2, 0))
+        return i, j, rows - i, columns - j
+
+    def sample(self, values:np.ndarray, locations:Iterable, method:Literal["nearest", "bilinear"]="nearest") -> np.ndarray:
+        """Values of a (..., lat, lon) array at each location (objects with lon and lat, eg. Coordinate).
+        Returns an (..., n_locations) array, eg. (leadtime, n_locations) for forecast blocks."""
+        locations = list(locations)
+        lon = np.array([location.lon for location in locations], dtype=np.float64)
+        lat = np.array([location.lat for location in locations], dtype=np.float64)
+        values = np.asarray(values)
+        if method == "nearest":
+            i, j = self.nearest(lon, lat)
+            return values[..., i, j]
+        if method == "bilinear":
+            i, j, di, dj = self.bilinear(lon, lat)
+            n_lat, n_lon = self.shape
+            i1 = np.minimum(i + 1, n_lat - 1)
+            j1 = np.minimum(j + 1, n_lon - 1)
+            return (values[..., i, j] * (1 - di) * (1 - dj) +
+                    values[..., i, j1] * (1 - di) * dj +
+                    values[..., i1, j] * di * (1 - dj) +
+                    values[..., i1, j1] * di * dj)
+        raise ValueError(f"Unknown interpolation method {method=}")
@@ -0,0 +1,46 @@
+# gunicorn -c gunicorn.conf.py wsgi:server
+#
+# Workers are forked after wsgi.py has loaded the dashboard state from its snapshot (preload_app), so N workers
+# share one copy of the forecast arrays, cropped GeoJSON and imported libraries. Without a snapshot each worker
+# builds its own copy, see wsgi.py. Forecast runs ingested with forecast_store.py
+# are memory-mapped and shared through the page cache as well. Each extra worker costs only the pages it writes.
+#
+# Scale workers with cores: WEB_CONCURRENCY=<cores> on a dedicated CPU, keep 2 on the shared 1 CPU / 1 GB fly.io VM.
+# Slider moves run in the browser, so worker time goes to page loads and color changes.
+import os
+import signal
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8050)}"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4) if multiprocessing.cpu_count() > 1 else 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 60
+max_requests = 2000 # Recycle workers now and then, the master keeps the preloaded state for the new ones
+max_requests_jitter = 200
+accesslog = "-"
+
+
+def when_ready(server):
+    # NOTE: The master polls for new runs. It builds the new state once and reloads the workers (HUP), which
+    # fork from it and share it again, as do workers recycled by max_requests.
+    import main
+    main.start_refresher(reload_workers=lambda: reload_workers(server))
+
+
+def reload_workers(server):
+    import gc
+    import geodata
+    geodata.close_datasets() # NOTE: HDF5 handles must not cross a fork, see wsgi.py
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+    os.kill(server.pid, signal.SIGHUP)
+
+
+def post_fork(server, worker):
+    # NOTE: Without a preloaded snapshot each worker builds the state itself, see wsgi.py
+    import main
+    if not main.state_ready.is_set():
+        main.start_warm_up()
@@ -0,0 +1,136 @@
+"""Level-of-detail pyramid for the choropleth map. Level 0 are the GeoJSON grid cells with rounded coordinates,
+coarser levels merge factor x factor cells into one polygon showing their mean. The browser picks the level
+by zoom (see assets/forecast.js) and fetches its GeoJSON from main.py, gzip compressed and cacheable.
+The default map zoom shows level 0, so colours and hover are the forecast cell values until the user zooms out.
+Hover shows the "[lon, lat]" of the cell, or of the block center on coarser levels, from the feature properties."""
+import gzip
+import json
+import hashlib
+from dataclasses import dataclass, replace
+
+import numpy as np
+import xarray as xr
+
+import geodata
+from geodata import GeoJSON
+from grid import GridIndex
+
+
+LOD_FACTORS = (1, 2, 4) # Grid cells per side merged into one polygon, finest level first
+LOD_MIN_ZOOM = (5.0, 4.0, 0.0) # Map zoom from which each level is used. NOTE: Level 0 must start at or below dashboard.MAP_ZOOM
+COORDINATE_DECIMALS = 4 # ~10 m, far below a grid cell
+
+
+@dataclass
+class LODLevel:
+    factor: int
+    min_zoom: float
+    values: np.ndarray # (leadtime, feature) float32. Feature k has the id str(k).
+    geojson: bytes # gzip compressed, compact GeoJSON
+    etag: str
+    index: np.ndarray # Flat grid cell (factor 1) or block of each feature, see level_values
+
+    @property
+    def cells(self) -> int:
+        return self.values.shape[1]
+
+
+def compact_feature(feature_id:int, rings:list, cell:str) -> dict:
+    """Feature with the short id str(feature_id) and the cell coordinates as its "cell" property, for the hover."""
+    return {
+        "type": "Feature",
+        "id": str(feature_id),
+        "properties": {"cell": cell},
+        "geometry": {"type": "Polygon", "coordinates": [[[round(lon, COORDINATE_DECIMALS), round(lat, COORDINATE_DECIMALS)] for lon, lat in ring] for ring in rings]}
+    }
+
+
+def encode_geojson(features:list[dict]) -> bytes:
+    text = json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+    return gzip.compress(text.encode("utf-8"), compresslevel=6, mtime=0) # mtime=0 keeps the bytes, and the etag, reproducible
+
+
+def make_level(factor:int, min_zoom:float, values:np.ndarray, features:list[dict], index:np.ndarray) -> LODLevel:
+    geojson = encode_geojson(features)
+    return LODLevel(factor, min_zoom, values.astype(np.float32), geojson, hashlib.sha1(geojson).hexdigest()[:16], index)
+
+
+def block_means(values:np.ndarray, present:np.ndarray, factor:int) -> tuple[np.ndarray, np.ndarray]:
+    """Mean of the present cells in each factor x factor block of (leadtime, lat, lon) values.
+    Returns the (leadtime, lat block, lon block) means and the mask of blocks with any present cell."""
+    n_time, n_lat, n_lon = values.shape
+    n_lat_blocks, n_lon_blocks = -(-n_lat // factor), -(-n_lon // factor)
+    padded = np.zeros((n_time, n_lat_blocks * factor, n_lon_blocks * factor))
+    counts = np.zeros(padded.shape)
+    valid = present & np.isfinite(values)
+    padded[:, :n_lat, :n_lon] = np.where(valid, values, 0)
+    counts[:, :n_lat, :n_lon] = valid
+    shape = (n_time, n_lat_blocks, factor, n_lon_blocks, factor)
+    sums = padded.reshape(shape).sum(axis=(2, 4))
+    counts = counts.reshape(shape).sum(axis=(2, 4))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    padded_present = np.zeros((n_lat_blocks * factor, n_lon_blocks * factor), dtype=bool)
+    padded_present[:n_lat, :n_lon] = present
+    return means, padded_present.reshape(n_lat_blocks, factor, n_lon_blocks, factor).any(axis=(1, 3))
+
+
+def build_lod(geojson:GeoJSON, forecast:xr.DataArray) -> list[LODLevel]:
+    """Pyramid of the cropped GeoJSON and its (leadtime, lat, lon) forecast. Features are matched to grid cells
+    by their "[lon, lat]" id like the map locations, features without a grid cell are left out."""
+    longitude, latitude = forecast["lon"].values, forecast["lat"].values
+    n_lat, n_lon = len(latitude), len(longitude)
+    values = np.asarray(forecast.values, dtype=np.float64)
+    cell_of_id = {cell_id: position for position, cell_id in enumerate(geodata.grid_ids(longitude, latitude).ravel().tolist())}
+
+    positions, features = [], []
+    for feature in geojson["features"]:
+        position = cell_of_id.get(feature.get("id"))
+        if position is None or feature["geometry"]["type"] != "Polygon": continue
+        features.append(compact_feature(len(positions), feature["geometry"]["coordinates"], feature["id"]))
+        positions.append(position)
+    positions = np.asarray(positions, dtype=np.int64)
+    levels = [make_level(LOD_FACTORS[0], LOD_MIN_ZOOM[0], values.reshape(len(values), -1)[:, positions], features, positions)]
+
+    present = np.zeros(n_lat * n_lon, dtype=bool)
+    present[positions] = True
+    present = present.reshape(n_lat, n_lon)
+    grid = GridIndex(longitude, latitude)
+    half_lon, half_lat = abs(grid.lon_step) / 2, abs(grid.lat_step) / 2
+    for factor, min_zoom in zip(LOD_FACTORS[1:], LOD_MIN_ZOOM[1:]):
+        means, blocks = block_means(values, present, factor)
+        rows, columns = np.nonzero(blocks)
+        # Block edges are the outer edges of its first and last grid cell
+        west = longitude[columns * factor] - half_lon
+        east = longitude[np.minimum((columns + 1) * factor, n_lon) - 1] + half_lon
+        north = latitude[rows * factor] + half_lat # NOTE: latitude descends
+        south = latitude[np.minimum((rows + 1) * factor, n_lat) - 1] - half_lat
+        features = [
+            compact_feature(k, [[(w, s), (e, s), (e, n), (w, n), (w, s)]], f"[{round((w + e) / 2, 2)}, {round((n + s) / 2, 2)}]")
+            for k, (w, e, n, s) in enumerate(zip(west.tolist(), east.tolist(), north.tolist(), south.tolist()))
+        ]
+        levels.append(make_level(factor, min_zoom, means[:, rows, columns], features, rows * blocks.shape[1] + columns))
+    return levels
+
+
+def level_values(levels:list[LODLevel], forecast:xr.DataArray) -> list[LODLevel]:
+    """levels with the values of another forecast on the same grid, eg. a newer run.
+    Only the means are recomputed, the GeoJSON and etags are reused so browsers keep their cached copies."""
+    values = np.asarray(forecast.values, dtype=np.float64)
+    n_time, n_lat, n_lon = values.shape
+    present = np.zeros(n_lat * n_lon, dtype=bool)
+    present[levels[0].index] = True
+    present = present.reshape(n_lat, n_lon)
+    updated = []
+    for level in levels:
+        means = values if level.factor == 1 else block_means(values, present, level.factor)[0]
+        updated.append(replace(level, values=means.reshape(n_time, -1)[:, level.index].astype(np.float32)))
+    return updated
+
+
+def level_for_zoom(levels:list[LODLevel], zoom:float) -> int:
+    """Finest level whose min_zoom is reached, the same choice as forecast.js makes in the browser."""
+    for position, level in enumerate(levels):
+        if zoom >= level.min_zoom:
+            return position
+    return len(levels) - 1
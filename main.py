@@ -1,148 +1,280 @@
-import math
+import time
+_process_start = time.perf_counter()
+
+import os
+import gzip
+import threading
+from typing import Callable, Optional
 
 import dash
-import pandas as pd
-from dash import dcc, html, Input, Output, Patch, State
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-
-import geodata
-from geodata import ForecastMultiQuery, GeoJSON
-import crop_geojson
-from pollution import accumulation, Coordinate
-
-# Region & data config
-CITY_REGIONS = {
-    "Paris": {"north": 54, "south": 44, "west": -4, "east": 8}
-}
-
-TIME_SPAN = 12
-DATETIME = datetime(2025, 5, 10, 0, 0)
-
-def get_geojson(region) -> GeoJSON:
-    geojson_path = "data/geojson/europe.forecast.geo.json"
-    return crop_geojson.crop_geojson(CITY_REGIONS[region], geojson_path)
-
-def get_data(leadtime: int, geojson: GeoJSON):
-    df = geodata.get_dataframe(ForecastMultiQuery(
-        variable="PM10",
-        time=DATETIME,
-        leadtimes=[leadtime],
-        model=None,
-        limits=geojson["limits"]
-    ))
-    return df
-
-def get_cumulative_exposure(time_span:int):
-    df = geodata.get_dataframe(ForecastMultiQuery(
-        variable="PM10",
-        time=DATETIME,
-        leadtimes=[_ for _ in range(time_span+1)],
-        model=None,
-        limits=geojson["limits"]
-    ))
-    cumulative_exposure = [accumulation(
-        df, Coordinate(lon=2.35, lat=48.85), 
-        DATETIME, DATETIME + timedelta(hours=i),
-        air_intake_cubics_per_minute=1)
-        for i in range(1, time_span+1)
-    ]
-    cumulative_exposure = [0] + cumulative_exposure
-    return cumulative_exposure
-
-# Initialize app and data
+import flask
+from dash import dcc, html, Input, Output, Patch, State, ClientsideFunction
+
+import metrics
+from cache import LRUCache
+
+# NOTE: The data modules (pandas, xarray, plotly figures) are imported by warm_up, after the server binds
+_dash_import_seconds = time.perf_counter() - _process_start
+
+# Initialize app, data is loaded in the background
 app = dash.Dash(__name__)
-geojson = get_geojson("Paris")
-locations = get_data(0, geojson).iloc[:, 0].tolist()
-cumulative_exposure = get_cumulative_exposure(TIME_SPAN)
-
-
-# Helper to build map figure
-def create_map_figure(leadtime):
-    df = get_data(leadtime, geojson)
-    fig = go.Figure(go.Choroplethmap(
-        geojson=geojson,
-        featureidkey="id",
-        locations=locations,
-        z=df["value"],
-        colorscale="Bupu",
-        marker=dict(opacity=0.4, line_width=0),
-        zmin=2,
-        zmax=20
-    ))
-    fig.update_layout(
-        map_center=dict(lon=2, lat=49),
-        map_zoom=5,
-        margin=dict(l=0, r=0, t=20, b=0),
-    )
-    return fig
+state = None # dashboard.DashboardState
+state_ready = threading.Event()
 
 
-def update_map_time(leadtime):
-    fig = Patch()
-    global geojson
-    df = get_data(leadtime, geojson)
-    fig.data[0].z = df["value"]
-    return fig
+def warm_up():
+    global state
+    try:
+        from_start = time.perf_counter()
+        import dashboard
+        timings = dashboard.Timings({"import dash": _dash_import_seconds, "import data modules": time.perf_counter() - from_start})
+        state = dashboard.load_state(timings)
+        print(f"Startup: {timings}, ready {time.perf_counter() - _process_start:.2f} s after process start")
+    finally:
+        state_ready.set() # NOTE: On failure requests get an error instead of hanging
 
 
-# Helper to build scatter plot
-def create_chart_figure(leadtime):
-    fig = go.Figure(go.Scatter(
-        x=[i for i in range(TIME_SPAN+1)],
-        y=cumulative_exposure[:leadtime+1],
-        mode="lines+markers",
-        name="PM10"
-    ),
-    layout_yaxis_range=[-100, math.ceil(cumulative_exposure[-1]/100)*100], # NOTE setting y-axis allows to see climbing motion when slider in moved
-    layout_xaxis_range=[-TIME_SPAN/10, TIME_SPAN+(TIME_SPAN/10)] # NOTE setting y-axis allows to see climbing motion when slider in moved
-    )
-    fig.update_layout(
-        yaxis_title="PM10",
-        xaxis_title="Leadtime",
-        margin=dict(l=40, r=10, t=20, b=40)
-    )
-    return fig
+def start_warm_up():
+    """Load the state in the background, requests wait for it in get_state."""
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def preload() -> bool:
+    """Load the state from its snapshot only, the fast path for the gunicorn master, which binds the port only
+    after preloading. Returns False when there is no snapshot of the latest run, the state is then built by
+    start_warm_up after the fork."""
+    global state
+    from_start = time.perf_counter()
+    import dashboard
+    timings = dashboard.Timings({"import dash": _dash_import_seconds, "import data modules": time.perf_counter() - from_start})
+    state = dashboard.load_state(timings, build=False)
+    if state is None:
+        print(f"Preload: no snapshot of the latest run, workers build the state ({timings})")
+        return False
+    state_ready.set()
+    print(f"Preload: {timings}")
+    return True
+
+
+def get_state():
+    """Dashboard state, waiting for warm_up if a request comes in before it finishes."""
+    state_ready.wait()
+    return state
+
+
+# New forecast runs are picked up by polling the catalog, see dashboard.load_state
+REFRESH_SECONDS = float(os.environ.get("REFRESH_SECONDS", 300)) # 0 disables polling
+PENDING_SECONDS = 10 # Polls of a master without a state
+refresh_stop = threading.Event()
+refresh_lock = threading.Lock()
+
+
+def refresh_state(build:bool=True) -> bool:
+    """Load the state of a newer run or changed files. The new state is built beside the current one and
+    swapped in with a single assignment, so in-flight requests finish with the state they already read.
+    Without build only a snapshot is loaded. Returns whether the state changed."""
+    global state
+    import dashboard
+    import geodata
+    current = get_state() if build else state
+    timings = dashboard.Timings()
+    # NOTE: Built without refresh_lock, forks do not wait for a build. NetCDF reads hold catalog.netcdf_lock instead.
+    refreshed = dashboard.load_state(timings, previous=current, build=build)
+    if refreshed is current:
+        return False
+    with refresh_lock:
+        state = refreshed
+        state_ready.set()
+        if current is not None and current.run != refreshed.run:
+            # NOTE: The replaced run is not read again, its decoded slices stay in the slice cache until evicted
+            geodata.close_run("PM10", current.run)
+        if current is not None and current.key is not None:
+            for path in set(current.key["files"]) - set(refreshed.key["files"]):
+                geodata.close_dataset(path)
+    metrics.increment("state_refreshes_total")
+    print(f"Refreshed to run {refreshed.run:%Y-%m-%d %H:%M}: {timings}")
+    return True
+
+
+def refresh_loop(reload_workers:Optional[Callable[[], None]]=None):
+    while not refresh_stop.wait(REFRESH_SECONDS if state is not None or reload_workers is None else PENDING_SECONDS):
+        try:
+            # NOTE: A gunicorn master without a state waits for the snapshot the workers build, see wsgi.py
+            if refresh_state(build=state is not None or reload_workers is None) and reload_workers:
+                reload_workers()
+        except Exception as e: # NOTE: Keep serving the current state, the next poll tries again
+            metrics.increment("state_refresh_errors_total")
+            print(f"Refresh failed: {e!r}")
+
+
+def start_refresher(reload_workers:Optional[Callable[[], None]]=None):
+    """Start polling in this process. The gunicorn master passes reload_workers, which replaces the workers
+    with ones forked from each new state, so they keep sharing it. NOTE: Threads do not survive a fork."""
+    if REFRESH_SECONDS <= 0:
+        return
+    if reload_workers:
+        # NOTE: No fork between the swap and closing the replaced handles, a worker would get a state whose files are half closed
+        os.register_at_fork(before=refresh_lock.acquire, after_in_parent=refresh_lock.release, after_in_child=refresh_lock.release)
+    threading.Thread(target=refresh_loop, args=(reload_workers,), name="refresh", daemon=True).start()
+
+
+def data_version() -> str:
+    """Version of the forecast files behind the state, see dashboard.data_version."""
+    current = get_state()
+    return current.version if current else ""
+
+
+# Layout and dependencies responses of the current data, shared by all visitors
+callback_cache = LRUCache(max_bytes=int(os.environ.get("CALLBACK_CACHE_MB", 32)) * 2**20)
+metrics.register_collector(lambda: metrics.cache_gauges("callbacks", callback_cache.stats()))
+
 
 # App layout
-app.layout = html.Div([
-    html.H3("Air Quality Forecast: Paris (PM10)"),
+def create_layout(state):
+    time_span = len(state.cumulative_exposure) - 1 if state else 0
+    return html.Div([
+        html.H3(f"Air Quality Forecast: Paris (PM10), run {state.run:%Y-%m-%d %H:%M}" if state else "Air Quality Forecast: Paris (PM10)"),
     
-    html.Div([
-        dcc.RadioItems(
-            id="color",
-            options=["Gradient", "Zones", "Viridis"],
-            value="Gradient",
-            inline=True
-        ),
-        dcc.Graph(id="map", figure=create_map_figure(0))
-    ], style={"display": "inline-block", "width": "48%", "verticalAlign": "top"}),
-
-    html.Div([
-        dcc.Graph(id="chart", figure=create_chart_figure(0))
-    ], style={"display": "inline-block", "width": "48%", "verticalAlign": "bottom"}),
-
-    html.Div([
-        dcc.Slider(
-            id="leadtime-slider",
-            min=0,
-            max=12,
-            step=1,
-            value=0,
-            marks={i: str(i) for i in range(TIME_SPAN+1)},
-            tooltip={"always_visible": True}
-        )
-    ], style={"padding": "40px 10px 10px 10px"})
-])
-
-# Callback to update both plots
-@app.callback(
+        html.Div([
+            dcc.RadioItems(
+                id="color",
+                options=["Gradient", "Zones", "Viridis"],
+                value="Gradient",
+                inline=True
+            ),
+            dcc.RadioItems(
+                id="layer",
+                options=["Concentration", "Dose"], # Dose: PM10 inhaled since run time at 1 m³/min
+                value="Concentration",
+                inline=True
+            ),
+            dcc.Graph(id="map", figure=state.map_figure if state else {}),
+            dcc.Store(id="forecast-frames", data=state.frames if state else None),
+            dcc.Store(id="dose-frames", data=state.dose_frames if state else None)
+        ], style={"display": "inline-block", "width": "48%", "verticalAlign": "top"}),
+
+        html.Div([
+            dcc.Graph(id="chart", figure=state.chart_figure if state else {})
+        ], style={"display": "inline-block", "width": "48%", "verticalAlign": "bottom"}),
+
+        html.Div([
+            dcc.Slider(
+                id="leadtime-slider",
+                min=0,
+                max=time_span,
+                step=1,
+                value=0,
+                marks={i: str(i) for i in range(time_span+1)},
+                tooltip={"always_visible": True}
+            )
+        ], style={"padding": "40px 10px 10px 10px"})
+    ])
+
+def serve_layout():
+    return create_layout(get_state())
+
+# NOTE: Dash validates callbacks against validation_layout, so assigning the layout function does not wait for data
+app.validation_layout = create_layout(None)
+app.layout = serve_layout
+
+# Request timing and the metrics endpoint, see metrics.py
+TIMED_PATHS = {"/", "/_dash-layout", "/_dash-dependencies", "/_dash-update-component", "/metrics"} # NOTE: bounded label values
+CACHED_PATHS = {"/_dash-layout", "/_dash-dependencies"} # Responses that only change with the data
+
+
+@app.server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+    flask.g.profiler = metrics.start_request_profile()
+
+
+@app.server.after_request
+def stop_request_timer(response:flask.Response) -> flask.Response:
+    seconds = time.perf_counter() - flask.g.request_start
+    path = flask.request.path if flask.request.path in TIMED_PATHS else "/geojson" if flask.request.path.startswith("/geojson/") else "other"
+    metrics.observe("http_request_seconds", seconds, path=path)
+    metrics.increment("http_responses_total", path=path, status=response.status_code)
+    metrics.finish_request_profile(flask.g.profiler, path.strip("/_") or "index", seconds)
+    return response
+
+
+@app.server.before_request
+def serve_cached_response():
+    """Layout and dependencies are built once per data version, repeat requests get the cached body."""
+    flask.g.data_version = data_version() if state_ready.is_set() else None
+    if flask.request.path in CACHED_PATHS and flask.g.data_version is not None:
+        body = callback_cache.get((flask.request.path, flask.g.data_version))
+        if body is not None:
+            return flask.Response(body, mimetype="application/json")
+
+
+@app.server.after_request
+def add_cache_headers(response:flask.Response) -> flask.Response:
+    """ETag on layout and dependencies, so a browser revalidating them gets an empty 304."""
+    if flask.request.path not in CACHED_PATHS or response.status_code != 200:
+        return response
+    version = flask.g.get("data_version") or (data_version() if state_ready.is_set() else None)
+    key = (flask.request.path, version)
+    if version is not None and key not in callback_cache:
+        callback_cache.put(key, response.get_data())
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(flask.request)
+
+
+@app.server.route("/metrics")
+def serve_metrics():
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.server.route("/metrics/profile", methods=["POST"])
+def arm_profiler():
+    """Dump the stacks of the next request slower than ?threshold= seconds (default 0.5) to PROFILE_DIR."""
+    try:
+        metrics.arm_profiler(float(flask.request.args.get("threshold", 0.5)))
+    except RuntimeError as e:
+        return flask.Response(str(e), status=403, mimetype="text/plain")
+    except ValueError:
+        return flask.Response("threshold must be a number of seconds", status=400, mimetype="text/plain")
+    return flask.Response("armed", mimetype="text/plain")
+
+
+@app.server.route("/geojson/<int:level>/<etag>.json")
+def serve_geojson(level:int, etag:str):
+    """Map GeoJSON of one level of detail (see lod.py). The url carries the etag, so browsers may keep it for good."""
+    levels = get_state().lod
+    if level >= len(levels):
+        flask.abort(404)
+    current = levels[level]
+    if "gzip" in flask.request.headers.get("Accept-Encoding", ""):
+        response = flask.Response(current.geojson, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = flask.Response(gzip.decompress(current.geojson), mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    response.set_etag(current.etag)
+    if etag == current.etag:
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True # Url of older data
+    return response.make_conditional(flask.request)
+
+
+# Slider moves, zooming and the layer switch swap precomputed frames and levels of detail in the browser, see assets/forecast.js
+app.clientside_callback(
+    ClientsideFunction(namespace="forecast", function_name="update_figures"),
     Output("map", "figure"),
     Output("chart", "figure"),
-    Input("leadtime-slider", "value")
+    Input("leadtime-slider", "value"),
+    Input("map", "relayoutData"),
+    Input("layer", "value"),
+    State("forecast-frames", "data"),
+    State("dose-frames", "data"),
+    State("map", "figure"),
+    State("chart", "figure")
 )
-def update_figures(leadtime):
-    return update_map_time(leadtime), create_chart_figure(leadtime)
 
 
 @app.callback(
@@ -150,6 +282,7 @@ def update_figures(leadtime):
     Input("color", "value"),
     prevent_initial_call=True
 )
+@metrics.timed("callback.change_color")
 def change_color(color:str):
     print(f"Change color: {color}")
     zones = [(0,"#fcfafa"), (0.19,"#fcfafb"), (0.20,"#c7dff0"), (0.39,"#c7dff1"), (0.4,"#77baed"), (0.59,"#77baee"), (0.6,"#943fa2"), (0.79,"#943fa1"), (0.8,"#4d004a"), (1,"#4d004b")]
@@ -167,4 +300,6 @@ def change_color(color:str):
 
 # Run app
 if __name__ == "__main__":
+    start_warm_up()
+    start_refresher()
     app.run(host="0.0.0.0", port=8050)
@@ -0,0 +1,207 @@
+"""Lightweight timing and counter hooks for the hot paths, rendered as Prometheus text by main.py at /metrics.
+Only the standard library is used so importing this module does not slow down startup.
+NOTE: Every gunicorn worker keeps its own numbers, Prometheus sums them per instance."""
+import os
+import sys
+import time
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILER_ENABLED = os.environ.get("METRICS_PROFILER") == "1" # Opt-in, arming it is exposed over HTTP
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # Last is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds:float):
+        position = 0
+        while position < len(BUCKETS) and seconds > BUCKETS[position]:
+            position += 1
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += seconds
+            self.count += 1
+
+
+_histograms: dict[tuple[str, tuple], Histogram] = {}
+_counters: dict[tuple[str, tuple], float] = {}
+_collectors: list[Callable[[], list[tuple[str, dict, float]]]] = []
+_registry_lock = threading.Lock()
+
+
+def observe(name:str, seconds:float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(seconds)
+
+
+def increment(name:str, amount:float=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _registry_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def timer(stage:str):
+    """Time a block into stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+
+def timed(stage:str):
+    """Decorator version of timer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe("stage_seconds", time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector:Callable[[], list[tuple[str, dict, float]]]):
+    """collector returns (metric name, labels, value) gauges read at scrape time, eg. cache statistics."""
+    _collectors.append(collector)
+
+
+def cache_gauges(cache:str, stats:dict) -> list[tuple[str, dict, float]]:
+    """Gauges of an LRUCache.stats() dict."""
+    return [
+        ("cache_hits_total", {"cache": cache}, stats["hits"]),
+        ("cache_misses_total", {"cache": cache}, stats["misses"]),
+        ("cache_hit_ratio", {"cache": cache}, stats["hit_ratio"]),
+        ("cache_evictions_total", {"cache": cache}, stats["evictions"]),
+        ("cache_entries", {"cache": cache}, stats["entries"]),
+        ("cache_bytes", {"cache": cache}, stats["bytes"]),
+        ("cache_max_bytes", {"cache": cache}, stats["max_bytes"])
+    ]
+
+
+def _labels(labels:dict|tuple) -> str:
+    items = labels.items() if isinstance(labels, dict) else labels
+    if not items: return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in items]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+    for (name, labels), histogram in sorted(_histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        with histogram._lock:
+            counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+        cumulative = 0
+        for bound, bucket_count in zip((*BUCKETS, "+Inf"), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels((*labels, ('le', str(bound))))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+    # NOTE: Samples of one metric must be contiguous, collectors may report the same names
+    collected = sorted((sample for collector in _collectors for sample in collector()), key=lambda sample: sample[0])
+    for name, labels, value in collected:
+        if name not in typed:
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread every interval seconds. The result is in folded format,
+    "outer;inner;leaf count" per line, which flamegraph.pl and speedscope read directly."""
+
+    def __init__(self, thread_id:int, interval:float=0.002):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._running = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+
+    def _sample(self):
+        while self._running.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self) -> "SamplingProfiler":
+        self._running.set()
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._running.clear()
+        self._thread.join()
+        return self.stacks
+
+    def write(self, name:str) -> Path:
+        directory = Path(PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{datetime.now():%Y%m%dT%H%M%S}-{name}.folded"
+        with open(path, "w") as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{stack} {samples}\n")
+        return path
+
+
+_armed_threshold: float|None = None
+
+
+def arm_profiler(threshold_seconds:float):
+    """Profile requests until one takes longer than threshold_seconds, then dump it and disarm."""
+    global _armed_threshold
+    if not PROFILER_ENABLED:
+        raise RuntimeError("Set METRICS_PROFILER=1 to enable the sampling profiler")
+    _armed_threshold = threshold_seconds
+
+
+def start_request_profile() -> SamplingProfiler|None:
+    if _armed_threshold is None: return None
+    return SamplingProfiler(threading.get_ident()).start()
+
+
+def finish_request_profile(profiler:SamplingProfiler|None, name:str, seconds:float) -> Path|None:
+    global _armed_threshold
+    if profiler is None: return None
+    profiler.stop()
+    if _armed_threshold is None or seconds < _armed_threshold: return None
+    _armed_threshold = None
+    return profiler.write(name)
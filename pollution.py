@@ -4,20 +4,49 @@ from typing import TypeAlias, Literal, overload
 
 import numpy as np
 import pandas as pd
+import xarray as xr
 
 import geodata
+import metrics
+from grid import GridIndex
 
 
 Coordinate = namedtuple('Coordinate', ['lon', 'lat'])
 Intake = namedtuple('Intake', ['cubics', 'litres'])
 
+EXPOSURE_CHUNK_CELLS = 2**15 # Cells per product in exposure_map_intervals, 97 float32 hours are ~12 MB
+
 def find_nearest(array, value):
     array = np.asarray(array)
     idx = (np.abs(array - value)).argmin()
     return array[idx]
 
 
-def accumulation(dataset:pd.DataFrame, location:Coordinate, exposure_start:datetime, exposure_end:datetime, air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None):
+def forecast_array(dataset:pd.DataFrame|xr.DataArray|geodata.CompactFrame) -> xr.DataArray:
+    if isinstance(dataset, xr.DataArray): return dataset
+    if isinstance(dataset, geodata.CompactFrame): return dataset.to_dataarray()
+    return geodata.frame_to_dataarray(dataset)
+
+
+@metrics.timed("pollution.location_series")
+def location_series(dataset:pd.DataFrame|xr.DataArray|geodata.CompactFrame, location:Coordinate, grid:GridIndex=None, method:Literal["nearest", "bilinear"]="nearest") -> np.ndarray:
+    """Hourly values at location, indexed by leadtime. Missing hours are NaN.
+    Pass a prebuilt grid to skip reading the coordinate axes on every call."""
+    array = forecast_array(dataset)
+    grid = grid or GridIndex.from_dataarray(array)
+    values = grid.sample(array.values, [location], method)[:, 0]
+
+    leadtimes = array["leadtime"].values.astype(np.int64)
+    series = np.full(leadtimes.max() + 1, np.nan)
+    series[leadtimes] = values
+    return series
+
+
+def accumulation(dataset:pd.DataFrame|xr.DataArray|geodata.CompactFrame, location:Coordinate, exposure_start:datetime, exposure_end:datetime, air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None, grid:GridIndex=None, method:Literal["nearest", "bilinear"]="nearest"):
+    """Pollutants inhaled at location between exposure_start and exposure_end. Each leadtime hour counts the
+    minutes the interval overlaps it. NOTE: The first version weighted a partial last hour by 60 minus its
+    minutes, eg. 00:00-01:20 counted 40 minutes of hour 1 instead of 20, and put an interval of at most an
+    hour wholly on its first hour, eg. 00:40-01:10 counted 30 minutes of hour 0."""
     if air_intake_cubics_per_minute and air_intake_litres_per_minute:
         raise ValueError("Give only either air_intake_cubics_per_minute or air_intake_litres_per_minute")
     if exposure_end < exposure_start:
@@ -25,66 +54,172 @@ def accumulation(dataset:pd.DataFrame, location:Coordinate, exposure_start:datet
     if exposure_start == exposure_end: return 0
 
     # Find data at exposure location
-    nearest_lon = find_nearest(dataset["lon"], location.lon)
-    nearest_lat = find_nearest(dataset["lat"], location.lat)
-    df = dataset[dataset["lon"] == nearest_lon]
-    df = df[df["lat"] == nearest_lat]
-    if len(df) == 0: raise ValueError("No data within exposure area")
-
-    # Find data within exposure time
-    start_time = exposure_start.hour
-    end_time = exposure_end.hour
-    if exposure_end.minute: end_time += 1
-    df = df[df["leadtime"] >= start_time][df["leadtime"] < end_time]
-    if exposure_end.hour > dataset["leadtime"].max(): raise ValueError("Exposure end time is too far into future")
-    if len(df) == 0: raise ValueError("No data within exposure time")
-
-    first_hour = df.iloc[:1]
-    mid_hours = df.iloc[1:-1]
-    last_hour = df.iloc[-1:]
-    #last_hour:pd.Series = df.iloc[-1] if len(df) > 1 else df.iloc[0]
-
-    # Set intake and multiplier
-    if isinstance(air_intake_cubics_per_minute, int):
-        in_take = air_intake_cubics_per_minute
-        multiplier = 1
-    elif isinstance(air_intake_litres_per_minute, int):
-        in_take = air_intake_litres_per_minute
-        multiplier = 0.001
-
-    exposed_time = exposure_end - exposure_start
-    hours_exposed = exposed_time.total_seconds() / 3600
-
-    inhaled_pollutants_accumulation:float = 0
-    if hours_exposed == 0: return 0
-    if hours_exposed <= 1:
-        if exposure_start.hour == exposure_end.hour:
-            minutes_exposed = exposure_end.minute - exposure_start.minute
+    array = forecast_array(dataset)
+    hourly_values = location_series(array, location, grid, method)
+
+    forecast_time = run_time(array, exposure_start)
+    inhaled = accumulation_intervals(
+        hourly_values,
+        hours_since(forecast_time, [exposure_start]),
+        hours_since(forecast_time, [exposure_end]),
+        air_intake_cubics_per_minute=air_intake_cubics_per_minute,
+        air_intake_litres_per_minute=air_intake_litres_per_minute
+    )
+    return float(inhaled[0])
+
+
+def run_time(array:xr.DataArray, exposure_start:datetime) -> datetime:
+    """Forecast run time of array. Frames do not carry it, leadtime 0 is then midnight of the exposure day."""
+    return array.attrs.get("time", datetime.combine(exposure_start.date(), datetime.min.time()))
+
+
+def hours_since(time:datetime, moments:list[datetime]) -> np.ndarray:
+    """Fractional hours from forecast run time, eg. 01:30 -> 1.5"""
+    return np.array([(moment - time).total_seconds() / 3600 for moment in moments], dtype=np.float64)
+
+
+def air_intake(air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None) -> float:
+    """Air intake in m³ per minute."""
+    if air_intake_cubics_per_minute and air_intake_litres_per_minute:
+        raise ValueError("Give only either air_intake_cubics_per_minute or air_intake_litres_per_minute")
+    if air_intake_cubics_per_minute is not None:
+        return air_intake_cubics_per_minute
+    if air_intake_litres_per_minute is not None:
+        return air_intake_litres_per_minute * 0.001
+    raise ValueError("Give either air_intake_cubics_per_minute or air_intake_litres_per_minute")
+
+
+def exposure_hours(exposure_starts:np.ndarray, exposure_ends:np.ndarray, n_hours:int) -> tuple[np.ndarray, np.ndarray]:
+    """Validated interval starts and ends in fractional hours since forecast run time."""
+    starts = np.asarray(exposure_starts, dtype=np.float64)
+    ends = np.asarray(exposure_ends, dtype=np.float64)
+    if np.any(ends < starts): raise ValueError("Exposure can not end before it started")
+    if np.any(starts < 0): raise ValueError("Exposure can not start before forecast time")
+    if np.any(ends > n_hours): raise ValueError("Exposure end time is too far into future")
+    return starts, ends
+
+
+@metrics.timed("pollution.accumulation_intervals")
+def accumulation_intervals(hourly_values:np.ndarray, exposure_starts:np.ndarray, exposure_ends:np.ndarray, air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None) -> np.ndarray:
+    """Inhaled pollutants for many exposure intervals at once.
+    hourly_values[h] is the concentration during leadtime hour h. Starts and ends are fractional hours
+    since forecast run time (see hours_since). Each hour is weighted by the minutes the interval
+    overlaps it, so partial first and last hours count minute by minute like in accumulation.
+    Cost is O(T) for the prefix sum plus O(1) per interval."""
+    in_take = air_intake(air_intake_cubics_per_minute, air_intake_litres_per_minute)
+    values = np.asarray(hourly_values, dtype=np.float64)
+    starts, ends = exposure_hours(exposure_starts, exposure_ends, len(values))
+
+    # Pollutant-minutes inhaled per unit of air from forecast time until the start of each hour.
+    # NOTE: Missing hours count as 0 in the sum and are counted apart, so a gap only fails the intervals it weighs in
+    missing = np.isnan(values)
+    values = np.where(missing, 0.0, values)
+    cumulative = np.concatenate(([0.0], np.cumsum(values * 60)))
+    missing_before = np.concatenate(([0], np.cumsum(missing)))
+
+    def integral(hours:np.ndarray) -> np.ndarray:
+        whole_hours = np.minimum(np.floor(hours).astype(np.int64), len(values) - 1)
+        return cumulative[whole_hours] + values[whole_hours] * (hours - whole_hours) * 60
+
+    # Hours floor(start) .. ceil(end) - 1 overlap a non-empty interval
+    first_hours = np.floor(starts).astype(np.int64)
+    last_hours = np.ceil(ends).astype(np.int64)
+    if np.any((ends > starts) & (missing_before[last_hours] > missing_before[first_hours])):
+        raise ValueError("No data within exposure time")
+    return (integral(ends) - integral(starts)) * in_take
+
+
+def hour_weights(exposure_starts:np.ndarray, exposure_ends:np.ndarray, n_hours:int) -> np.ndarray:
+    """(interval, hour) minutes each interval overlaps each leadtime hour, the weighting of accumulation_intervals."""
+    hours = np.arange(n_hours, dtype=np.float64)
+    overlap = np.minimum(exposure_ends[:, np.newaxis], hours + 1) - np.maximum(exposure_starts[:, np.newaxis], hours)
+    return np.clip(overlap, 0, None) * 60
+
+
+@metrics.timed("pollution.exposure_map_intervals")
+def exposure_map_intervals(dataset:pd.DataFrame|xr.DataArray|geodata.CompactFrame, exposure_starts:np.ndarray, exposure_ends:np.ndarray, air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None, chunk_cells:int=EXPOSURE_CHUNK_CELLS) -> xr.DataArray:
+    """Inhaled pollutants in every grid cell for many exposure intervals at once, an (interval, lat, lon) float32
+    array. Starts and ends are fractional hours since forecast run time like in accumulation_intervals, with the
+    same minute weighting of partial hours. The grid is an (interval, hour) x (hour, cell) product taken
+    chunk_cells cells at a time on the float32 values, so besides the result only one chunk is copied.
+    Cells missing an hour of their interval are NaN."""
+    in_take = air_intake(air_intake_cubics_per_minute, air_intake_litres_per_minute)
+    array = forecast_array(dataset)
+    leadtimes = array["leadtime"].values.astype(np.int64)
+    _, n_lat, n_lon = array.shape
+    values = np.asarray(array.values, dtype=np.float32).reshape(len(leadtimes), -1) # NOTE: A view of float32 input
+    n_hours = leadtimes.max() + 1
+    starts, ends = exposure_hours(np.atleast_1d(exposure_starts), np.atleast_1d(exposure_ends), n_hours)
+
+    weights = hour_weights(starts, ends, n_hours)
+    absent = np.ones(n_hours, dtype=bool)
+    absent[leadtimes] = False
+    gap = (weights[:, absent] > 0).any(axis=1) # Intervals weighing an hour missing from the time axis
+    weights = (weights[:, leadtimes] * in_take).astype(np.float32)
+    weighted = (weights > 0).astype(np.float32)
+
+    inhaled = np.empty((len(starts), values.shape[1]), dtype=np.float32)
+    for first in range(0, values.shape[1], chunk_cells):
+        chunk = values[:, first:first + chunk_cells]
+        missing = np.isnan(chunk)
+        if missing.any():
+            inhaled[:, first:first + chunk_cells] = weights @ np.where(missing, np.float32(0), chunk)
+            inhaled[:, first:first + chunk_cells][(weighted @ missing) > 0] = np.nan # Cells missing a weighted hour
         else:
-            minutes_exposed = 60 - exposure_start.minute + exposure_end.minute
-        pollutants_in_unit_of_air:float = df.iloc[0]["value"] * multiplier # 1 or 0.001
-        return pollutants_in_unit_of_air * minutes_exposed * in_take
-    if hours_exposed < 2: mid_hours = df.iloc[0:0] # Empty
-    
-    # Calculate exposure amount
-    for row in first_hour.iterrows():
-        pollutants_in_unit_of_air:float = row[1]["value"] * multiplier # 1 or 0.001
-        minutes_exposed = 60 - exposure_start.minute
-        inhaled_pollutants_accumulation += pollutants_in_unit_of_air * minutes_exposed * in_take
-    
-    for row in mid_hours.iterrows():
-        pollutants_in_unit_of_air:float = row[1]["value"] * multiplier # 1 or 0.001
-        minutes_exposed = 60
-        inhaled_pollutants_accumulation += pollutants_in_unit_of_air * minutes_exposed * in_take
-    
-    for row in last_hour.iterrows():
-        pollutants_in_unit_of_air:float = row[1]["value"] * multiplier # 1 or 0.001
-        minutes_exposed = 60 - exposure_end.minute
-        inhaled_pollutants_accumulation += pollutants_in_unit_of_air * minutes_exposed * in_take
-
-    return inhaled_pollutants_accumulation
+            inhaled[:, first:first + chunk_cells] = weights @ chunk
+    inhaled[gap] = np.nan
+    return xr.DataArray(
+        inhaled.reshape(len(starts), n_lat, n_lon),
+        dims=("interval", "lat", "lon"),
+        coords={"lat": array["lat"].values, "lon": array["lon"].values},
+        name=array.name,
+        attrs=dict(array.attrs)
+    )
 
 
+def exposure_map(dataset:pd.DataFrame|xr.DataArray|geodata.CompactFrame, exposure_start:datetime, exposure_end:datetime, air_intake_cubics_per_minute:float=None, air_intake_litres_per_minute:float=None) -> xr.DataArray:
+    """accumulation for every grid cell at once, a (lat, lon) array."""
+    if exposure_end < exposure_start:
+        raise ValueError(f"Exposure can not end before it started. {exposure_start=} {exposure_end=}")
+    array = forecast_array(dataset)
+    forecast_time = run_time(array, exposure_start)
+    return exposure_map_intervals(
+        array,
+        hours_since(forecast_time, [exposure_start]),
+        hours_since(forecast_time, [exposure_end]),
+        air_intake_cubics_per_minute=air_intake_cubics_per_minute,
+        air_intake_litres_per_minute=air_intake_litres_per_minute
+    )[0]
+
+
+def filter_replacement_hours(hourly_values:np.ndarray, air_intake_cubics_per_minute:np.ndarray, filter_capacity:np.ndarray, filter_load:np.ndarray=0) -> tuple[np.ndarray, np.ndarray]:
+    """Hours since forecast run time until each filter has collected filter_capacity, for many sites at once.
+    hourly_values is (leadtime hour, site) and the other arguments are per site, loads in the unit of
+    accumulation (concentration times m³). Inside the forecast the crossing is found minute by minute
+    like accumulation_intervals, after it the mean rate of the forecast is extrapolated.
+    Returns (hours, within_forecast). Sites with missing values get NaN hours."""
+    values = np.asarray(hourly_values, dtype=np.float64)
+    n_hours = values.shape[0]
+    in_take = np.asarray(air_intake_cubics_per_minute, dtype=np.float64)
+    capacity = np.broadcast_to(np.asarray(filter_capacity, dtype=np.float64), values.shape[1:])
+    load = np.broadcast_to(np.asarray(filter_load, dtype=np.float64), values.shape[1:])
+
+    # Load collected by the start of each hour, (n_hours + 1, site)
+    rate = values * 60 * in_take
+    cumulative = load + np.concatenate((np.zeros((1, *rate.shape[1:])), np.cumsum(rate, axis=0)))
+
+    reached = cumulative[1:] >= capacity
+    within_forecast = reached.any(axis=0)
+    hour = reached.argmax(axis=0)
+    sites = np.arange(values.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inside = hour + (capacity - cumulative[hour, sites]) / rate[hour, sites]
+        mean_rate = (cumulative[-1] - load) / n_hours
+        beyond = n_hours + (capacity - cumulative[-1]) / mean_rate
+    hours = np.where(within_forecast, inside, np.where(mean_rate > 0, beyond, np.inf))
+    hours = np.where(load >= capacity, 0.0, hours)
+    hours = np.where(np.isnan(values).any(axis=0), np.nan, hours)
+    return hours, within_forecast & ~np.isnan(hours)
 
 
 if __name__ == "__main__":
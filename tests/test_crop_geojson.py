@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import crop_geojson
+from benchmarks import synthetic
+
+
+LIMITS = [
+    {"north": 54, "south": 44, "west": -4, "east": 8},
+    {"north": 71, "south": 31, "west": -24, "east": 44},
+    {"north": 30, "south": 20, "west": 0, "east": 10} # Outside the domain
+]
+
+
+@pytest.fixture(params=["compact", "indented"])
+def geojson_path(request, tmp_path):
+    """About 300 cells. Indented adds whitespace between features and a non-ASCII property, which is two bytes in UTF-8."""
+    path = synthetic.write_geojson(tmp_path / "europe.geo.json", 300)
+    if request.param == "indented":
+        with open(path, "r", encoding="utf-8") as file:
+            geojson = json.load(file)
+        for feature in geojson["features"]:
+            feature["properties"] = {"name": "Zürich–Genève"}
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(geojson, file, indent=2, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes(monkeypatch):
+    monkeypatch.setattr(crop_geojson, "_indexes", {})
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 2**20]) # NOTE: Small chunks split features and keys across reads
+def test_feature_spans_match_json_loads(geojson_path, chunk_size, monkeypatch):
+    monkeypatch.setattr(crop_geojson, "READ_CHUNK_SIZE", chunk_size)
+    with open(geojson_path, "r", encoding="utf-8") as file:
+        expected = json.load(file)["features"]
+    with open(geojson_path, "rb") as file:
+        data = file.read()
+    spans = list(crop_geojson.iter_feature_spans(geojson_path))
+    assert [json.loads(data[offset:offset + length]) for offset, length, _ in spans] == expected
+
+
+@pytest.mark.parametrize("chunk_size", [7, 2**20])
+@pytest.mark.parametrize("limits", LIMITS)
+def test_indexed_crop_matches_full_load(geojson_path, limits, chunk_size, monkeypatch):
+    monkeypatch.setattr(crop_geojson, "READ_CHUNK_SIZE", chunk_size)
+    with open(geojson_path, "r", encoding="utf-8") as file:
+        expected = crop_geojson.crop_geojson(limits, json.load(file))
+    assert crop_geojson.crop_geojson(limits, geojson_path) == expected
+    monkeypatch.setattr(crop_geojson, "_indexes", {})
+    assert crop_geojson.crop_geojson(limits, geojson_path) == expected # From the index file
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import fleet
+import geodata
+from catalog import Catalog
+from pollution import filter_replacement_hours
+from benchmarks import synthetic
+
+
+RUN = datetime(2025, 5, 10)
+
+
+def test_filter_replacement_hours():
+    """10 per m³ at 1 m³ per minute collects 600 an hour for 3 hours, after that the mean rate is extrapolated."""
+    values = np.array([[10.0, 10.0, 10.0, 10.0]] * 3)
+    values[1, 3] = np.nan
+    hours, within_forecast = filter_replacement_hours(values, np.ones(4), np.array([900, 1200, 3000, 900]), np.array([0, 600, 0, 0]))
+    np.testing.assert_allclose(hours[:3], [1.5, 1.0, 5.0])
+    assert np.isnan(hours[3])
+    assert within_forecast.tolist() == [True, True, False, False]
+
+
+def test_filter_replacement_hours_full_filter():
+    hours, within_forecast = filter_replacement_hours(np.full((3, 1), 10.0), np.ones(1), np.array([500]), np.array([800]))
+    assert hours.tolist() == [0.0] and within_forecast.tolist() == [True]
+
+
+@pytest.fixture
+def gapped_catalog(tmp_path, monkeypatch):
+    """A run whose time axis starts at hour 24 and lacks hour 26."""
+    path = synthetic.write_forecast_nc(tmp_path / "EU-forecast-PM10-2025-05-10-24" / "ENS_FORECAST.nc", 420, 700, 3, hours=[24, 25, 27]) # The 0.1° CAMS grid
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(tmp_path)))
+    geodata.close_datasets()
+    geodata.slice_cache.clear()
+    yield path
+    geodata.close_datasets()
+
+
+def sites(capacity:float) -> dict[str, np.ndarray]:
+    return {
+        "site": np.arange(2),
+        "lon": np.array([2.35, 10.0]),
+        "lat": np.array([48.85, 50.0]),
+        "air_intake_cubics_per_minute": np.ones(2),
+        "filter_capacity": np.full(2, capacity),
+        "filter_load": np.zeros(2)
+    }
+
+
+def test_predict_chunk_counts_hours_since_run(gapped_catalog):
+    forecast = geodata.query_forecast(geodata.ForecastMultiQuery("PM10", RUN, [24], None, None), as_array=True)
+    value = float(forecast.sel(lon=2.35, lat=48.85, method="nearest").values[0])
+    result = fleet.predict_chunk(sites(value * 30), "PM10", RUN, None, [24, 25])
+    assert result["hours"][0] == pytest.approx(24.5)
+    assert result["within_forecast"][0]
+
+
+def test_predict_chunk_gapped_axis_is_not_shifted(gapped_catalog):
+    """Hour 27 must not be integrated as hour 26, sites on the gapped axis get NaN hours."""
+    result = fleet.predict_chunk(sites(1e9), "PM10", RUN, None, geodata.forecast_leadtimes("PM10", RUN))
+    assert np.isnan(result["hours"]).all()
+    assert not result["within_forecast"].any()
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import numpy as np
+import xarray as xr
+
+import forecast_db
+import geodata
+from geodata import ForecastMultiQuery
+from benchmarks import synthetic
+
+
+RUN = datetime(2025, 5, 10)
+
+
+def test_load_netcdf_labels_rows_by_time_axis(tmp_path):
+    """Leadtimes come from the file's time axis, which may not start at 0 or may have gaps."""
+    path = synthetic.write_forecast_nc(tmp_path / "ENS_FORECAST.nc", 10, 12, 3)
+    with xr.open_dataset(path, engine="netcdf4", decode_timedelta=False) as ds:
+        ds = ds.load().assign_coords(time=np.array([24.0, 25.0, 27.0]))
+    gapped = tmp_path / "gapped" / "ENS_FORECAST.nc"
+    gapped.parent.mkdir()
+    ds.to_netcdf(gapped, engine="netcdf4")
+
+    db_path = str(tmp_path / "forecasts.db")
+    forecast_db.load_netcdf(str(gapped), "PM10", "pm10_conc", RUN, db_path=db_path)
+    df = geodata.query_forecast_db(ForecastMultiQuery("PM10", RUN, 30, None, None), db_path)
+    assert sorted(np.unique(df["leadtime"]).tolist()) == [24.0, 25.0, 27.0]
+    hour_27 = df[df["leadtime"] == 27.0]["value"].to_numpy()
+    assert np.allclose(hour_27, ds["pm10_conc"].isel(time=2, level=0).values.ravel())
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import forecast_store
+import geodata
+from catalog import Catalog
+from geodata import ForecastMultiQuery
+from benchmarks import synthetic
+
+
+RUN = datetime(2025, 5, 10)
+
+
+@pytest.fixture
+def two_models(tmp_path, monkeypatch):
+    """ENS and CHIMERE of the same run ingested into the store under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(tmp_path / "data/netcdf")))
+    run_dir = tmp_path / "data/netcdf/EU-forecast-PM10-2025-05-10-24"
+    paths = {model: synthetic.write_forecast_nc(run_dir / f"{model}_FORECAST.nc", 10, 12, 2, seed=seed) for seed, model in enumerate(["ENS", "CHIMERE"])}
+    for path in paths.values():
+        forecast_store.ingest(str(path))
+    return paths
+
+
+def file_values(path) -> np.ndarray:
+    with xr.open_dataset(path, engine="netcdf4", decode_timedelta=False) as ds:
+        return ds["pm10_conc"].isel(level=0).values
+
+
+def test_store_keeps_each_model_of_a_run(two_models):
+    for model in ("ENS", "CHIMERE"):
+        assert forecast_store.has_run("pm10_conc", RUN, model)
+        array = geodata.query_forecast(ForecastMultiQuery("PM10", RUN, [0, 1], model, None), as_array=True)
+        assert np.array_equal(array.values, file_values(two_models[model]))
+    # Without a model the ensemble is read, like from the catalog
+    array = geodata.query_forecast(ForecastMultiQuery("PM10", RUN, [0, 1], None, None), as_array=True)
+    assert np.array_equal(array.values, file_values(two_models["ENS"]))
+
+
+def test_store_does_not_serve_another_model(two_models):
+    assert not forecast_store.has_run("pm10_conc", RUN, "EMEP")
+    with pytest.raises(ValueError, match="EMEP"):
+        geodata.query_forecast(ForecastMultiQuery("PM10", RUN, [0], "EMEP", None))
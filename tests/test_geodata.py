@@ -0,0 +1,166 @@
+import os
+import tracemalloc
+from dataclasses import replace
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import geodata
+from geodata import ForecastMultiQuery, AnalysisQuery
+from catalog import Catalog
+from benchmarks import synthetic
+
+
+def query_forecast_nc_baseline(query:ForecastMultiQuery, path:str) -> pd.DataFrame:
+    """query_forecast_nc before it was vectorized, kept as the reference for the frame it must return."""
+    ds = xr.open_dataset(path, engine="netcdf4", decode_timedelta=False)
+    all_values = ds.variables["pm10_conc"][query.leadtimes][0].data # lat lon
+    all_longitudes = list(map(lambda lon: lon if lon < 180 else lon - 360, ds.variables["longitude"].data.tolist()))
+    all_latitudes:list = ds.variables["latitude"].data.tolist()
+
+    values = all_values
+    longitude = all_longitudes
+    latitude = all_latitudes
+    if query.limits:
+        west_limit_idx = min([i for i, lon in enumerate(all_longitudes) if lon > query.limits["west"]])
+        east_limit_idx = max([i for i, lon in enumerate(all_longitudes) if lon < query.limits["east"]])
+        north_limit_idx = min([i for i, lat in enumerate(all_latitudes) if lat < query.limits["north"]])
+        south_limit_idx = max([i for i, lat in enumerate(all_latitudes) if lat > query.limits["south"]])
+        longitude = all_longitudes[west_limit_idx:east_limit_idx + 1]
+        latitude = all_latitudes[north_limit_idx:south_limit_idx + 1]
+        values = all_values[north_limit_idx:south_limit_idx + 1, west_limit_idx:east_limit_idx + 1]
+
+    LON, LAT = np.meshgrid(longitude, latitude)
+    matrix_np = np.stack((LON, LAT), axis=-1)
+    coordinates = [[[round(lat[0],2), round(lat[1],2)] for lat in lon] for lon in matrix_np.tolist()]
+    values_expanded = values[:, :, np.newaxis]
+    results = np.concatenate((values_expanded, coordinates), axis=2)
+    time_array = np.full((len(latitude), len(longitude), 1), query.leadtimes)
+    results = np.concatenate((results, time_array), axis=2)
+    flat_result = results.reshape(-1, 4)
+
+    df = pd.DataFrame(flat_result, columns=["value", "lon", "lat", "leadtime"])
+    df['id'] = df.apply(lambda row: f"[{row['lon']}, {row['lat']}]", axis=1)
+    df = df[['id'] + [col for col in df.columns if col != 'id']]
+    ds.close()
+    return df
+
+
+@pytest.fixture(scope="module")
+def forecast_path(tmp_path_factory):
+    # NOTE: The 0.1° CAMS grid, cell centers at .05
+    return str(synthetic.write_forecast_nc(tmp_path_factory.mktemp("nc") / "ENS_FORECAST.nc", 420, 700, 3))
+
+
+@pytest.fixture(autouse=True)
+def cold_caches():
+    geodata.close_datasets()
+    geodata.slice_cache.clear()
+    yield
+    geodata.close_datasets()
+
+
+def center_limits(path:str) -> dict:
+    """Limits equal to the float32 cell centers of the file."""
+    latitude, longitude = synthetic.grid_axes(420, 700)
+    longitude = geodata.longitude_180(longitude)
+    return {"north": float(latitude[5]), "south": float(latitude[20]), "west": float(longitude[3]), "east": float(longitude[30])}
+
+
+@pytest.mark.parametrize("limits", [
+    None,
+    {"north": 54, "south": 44, "west": -4, "east": 8},
+    {"north": 50.05, "south": 49.05, "west": 2.05, "east": 3.05}, # Cell centers in decimal
+    "centers"
+])
+@pytest.mark.parametrize("leadtime", [0, 2])
+def test_query_forecast_nc_matches_baseline(forecast_path, limits, leadtime):
+    if limits == "centers":
+        limits = center_limits(forecast_path)
+    query = ForecastMultiQuery(variable="PM10", time=datetime(2025, 5, 10), leadtimes=leadtime, model=None, limits=limits)
+    expected = query_forecast_nc_baseline(query, forecast_path)
+    pd.testing.assert_frame_equal(geodata.query_forecast_nc(query, path=forecast_path), expected)
+
+
+def test_compact_frame_matches_frame(forecast_path):
+    query = ForecastMultiQuery(variable="PM10", time=datetime(2025, 5, 10), leadtimes=[0, 1, 2], model=None, limits=center_limits(forecast_path))
+    pd.testing.assert_frame_equal(geodata.query_forecast_nc(query, path=forecast_path, compact=True).frame, geodata.query_forecast_nc(query, path=forecast_path))
+
+
+def test_slice_cache_holds_no_views(forecast_path):
+    """Cached slices own their memory, so the byte bound of slice_cache holds."""
+    query = ForecastMultiQuery(variable="PM10", time=datetime(2025, 5, 10), leadtimes=[0, 1, 2], model=None, limits=None)
+    geodata.query_forecast_nc(query, path=forecast_path, as_array=True)
+    handle = geodata.open_forecast_dataset(forecast_path)
+    crop = (0, 420, 0, 700)
+    for leadtime in range(3):
+        values = geodata.slice_cache.get((handle.path, handle.mtime, "pm10_conc", leadtime, *crop))
+        assert values is not None and values.base is None
+
+
+def open_descriptors() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="Counts open files in /proc")
+def test_query_analysis_memory_flat_in_files(tmp_path, monkeypatch):
+    """Each analysis file is closed once its hours are read, so open files and the traced peak do not grow
+    with the number of files."""
+    synthetic.write_analysis_days(tmp_path, datetime(2025, 5, 1), 12, 84, 140)
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(tmp_path / "data/netcdf")))
+
+    def run(days:int) -> tuple[int, int]:
+        query = AnalysisQuery(variable="PM10", start_time=datetime(2025, 5, 1), end_time=datetime(2025, 5, 1 + days))
+        descriptors = open_descriptors()
+        most_open = 0
+        tracemalloc.start()
+        aggregate = None
+        for chunk in geodata.iter_analysis_chunks(query):
+            aggregate = aggregate or geodata.AnalysisAggregate.empty(chunk.longitude, chunk.latitude)
+            aggregate.update(chunk)
+            most_open = max(most_open, open_descriptors() - descriptors)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert aggregate.hours.max() == days * 24
+        assert geodata.cache_stats()["datasets_open"] == 0
+        assert open_descriptors() == descriptors
+        return most_open, peak
+
+    few_open, few_peak = run(2)
+    many_open, many_peak = run(12)
+    assert many_open == few_open
+    assert many_peak < few_peak * 1.2
+
+
+def test_query_forecast_nc_reads_gapped_time_axis(tmp_path, monkeypatch):
+    """Leadtimes are hours of the file's time axis like in forecast_store and forecast_db, not positions."""
+    path = synthetic.write_forecast_nc(tmp_path / "EU-forecast-PM10-2025-05-10-24" / "ENS_FORECAST.nc", 10, 12, 3, hours=[24, 25, 27])
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(tmp_path)))
+    assert geodata.forecast_leadtimes("PM10", datetime(2025, 5, 10)) == [24, 25, 27]
+
+    query = ForecastMultiQuery(variable="PM10", time=datetime(2025, 5, 10), leadtimes=[27, 24], model=None, limits=None)
+    array = geodata.query_forecast_nc(query, as_array=True)
+    with xr.open_dataset(path, engine="netcdf4", decode_timedelta=False) as ds:
+        expected = ds["pm10_conc"].isel(time=[2, 0], level=0).values
+    assert array["leadtime"].values.tolist() == [27, 24]
+    assert np.array_equal(array.values, expected)
+    with pytest.raises(ValueError, match="not in"):
+        geodata.query_forecast_nc(replace(query, leadtimes=[26]))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_reopens_datasets(forecast_path):
+    """A worker forked while the master has files open, eg. during a build, never uses the inherited handles."""
+    inherited = geodata.open_forecast_dataset(forecast_path)
+    pid = os.fork()
+    if pid == 0: # NOTE: The child reports through its exit code, pytest must not run on in it
+        try:
+            handle = geodata.open_forecast_dataset(forecast_path)
+            os._exit(0 if geodata.cache_stats()["datasets_open"] == 1 and handle is not inherited else 1)
+        except BaseException:
+            os._exit(2)
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+    assert geodata.open_forecast_dataset(forecast_path) is inherited
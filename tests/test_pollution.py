@@ -0,0 +1,113 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import geodata
+import pollution
+from grid import GridIndex
+from pollution import Coordinate
+from benchmarks import synthetic
+
+
+RUN = datetime(2025, 5, 10)
+PARIS = Coordinate(lon=2.35, lat=48.85)
+
+
+def hourly_forecast(hourly_values:list[float]) -> xr.DataArray:
+    """3x3 cells around Paris, every cell with the same value in each leadtime hour."""
+    values = np.broadcast_to(np.asarray(hourly_values, dtype=np.float32)[:, np.newaxis, np.newaxis], (len(hourly_values), 3, 3))
+    return xr.DataArray(
+        values,
+        dims=("leadtime", "lat", "lon"),
+        coords={"leadtime": np.arange(len(hourly_values)), "lat": [48.95, 48.85, 48.75], "lon": [2.25, 2.35, 2.45]},
+        attrs={"time": RUN}
+    )
+
+
+@pytest.mark.parametrize("start, end, baseline, expected", [
+    # Behaviour change: each hour counts the minutes the interval overlaps it. The baseline weighted a partial
+    # last hour by 60 minus its end minute, and put an interval of at most an hour wholly on its first hour.
+    ((0, 0), (1, 20), 10 * 60 + 20 * 40, 10 * 60 + 20 * 20),
+    ((0, 30), (5, 40), 10 * 30 + (20 + 30 + 40 + 50) * 60 + 60 * 20, 10 * 30 + (20 + 30 + 40 + 50) * 60 + 60 * 40),
+    ((0, 40), (1, 10), 10 * 30, 10 * 20 + 20 * 10),
+    # Unchanged: intervals within one hour and whole hours
+    ((2, 15), (2, 45), 30 * 30, 30 * 30),
+    ((1, 0), (4, 0), (20 + 30 + 40) * 60, (20 + 30 + 40) * 60)
+])
+def test_accumulation_weights_partial_hours_by_minute(start, end, baseline, expected):
+    forecast = hourly_forecast([10, 20, 30, 40, 50, 60])
+    inhaled = pollution.accumulation(
+        forecast, PARIS, RUN.replace(hour=start[0], minute=start[1]), RUN.replace(hour=end[0], minute=end[1]),
+        air_intake_litres_per_minute=1000
+    )
+    assert inhaled == pytest.approx(expected)
+    assert (inhaled == pytest.approx(baseline)) == (baseline == expected)
+
+
+def gapped_forecast() -> xr.DataArray:
+    """Leadtimes 0, 3 and 6 only, location_series fills hours 1, 2, 4 and 5 with NaN."""
+    forecast = hourly_forecast([10, 20, 30])
+    return forecast.assign_coords(leadtime=[0, 3, 6])
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    ((0, 0), (0, 30), 10 * 30),
+    ((0, 30), (1, 0), 10 * 30),
+    ((3, 0), (3, 30), 20 * 30),
+    ((6, 0), (6, 30), 30 * 30),
+    ((3, 15), (3, 15), 0)
+])
+def test_accumulation_after_missing_hours(start, end, expected):
+    inhaled = pollution.accumulation(
+        gapped_forecast(), PARIS, RUN.replace(hour=start[0], minute=start[1]), RUN.replace(hour=end[0], minute=end[1]),
+        air_intake_cubics_per_minute=1
+    )
+    assert inhaled == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("start, end", [((0, 30), (1, 1)), ((2, 30), (3, 30)), ((3, 0), (4, 1))])
+def test_accumulation_over_missing_hour_raises(start, end):
+    with pytest.raises(ValueError, match="No data"):
+        pollution.accumulation(
+            gapped_forecast(), PARIS, RUN.replace(hour=start[0], minute=start[1]), RUN.replace(hour=end[0], minute=end[1]),
+            air_intake_cubics_per_minute=1
+        )
+
+
+def test_exposure_map_matches_accumulation():
+    forecast = hourly_forecast([10, 20, 30, 40, 50, 60])
+    dose = pollution.exposure_map(forecast, RUN.replace(minute=30), RUN.replace(hour=5, minute=40), air_intake_cubics_per_minute=1)
+    assert np.allclose(dose.values, pollution.accumulation(forecast, PARIS, RUN.replace(minute=30), RUN.replace(hour=5, minute=40), air_intake_cubics_per_minute=1))
+
+
+def test_exposure_map_intervals_matches_dense_product():
+    """Chunked float32 product equals one float64 product over the hourly axis, with NaN cells and a gap hour."""
+    rng = np.random.default_rng(0)
+    values = rng.uniform(5, 30, (4, 5, 7)).astype(np.float32)
+    values[1, 2, 3] = np.nan
+    forecast = xr.DataArray(values, dims=("leadtime", "lat", "lon"), coords={"leadtime": [0, 1, 2, 4], "lat": np.arange(5.0)[::-1], "lon": np.arange(7.0)})
+    starts, ends = np.array([0, 0.5, 1.25, 2.5]), np.array([1, 2, 2.75, 5])
+
+    hourly = np.full((5, 35), np.nan)
+    hourly[[0, 1, 2, 4]] = values.reshape(4, -1)
+    weights = pollution.hour_weights(starts, ends, 5)
+    expected = weights @ np.nan_to_num(hourly) * 2
+    expected[(weights > 0) @ np.isnan(hourly)] = np.nan
+
+    dose = pollution.exposure_map_intervals(forecast, starts, ends, air_intake_cubics_per_minute=2, chunk_cells=4)
+    assert dose.dtype == np.float32
+    np.testing.assert_allclose(dose.values.reshape(4, -1), expected, rtol=1e-6)
+    assert np.isnan(dose.values[3]).all() # Hour 3 is missing from the time axis
+    assert np.isnan(dose.values[1, 2, 3]) and not np.isnan(dose.values[0, 2, 3])
+
+
+@pytest.mark.parametrize("n_lat, n_lon", [(40, 60), (105, 175), (420, 700)])
+def test_grid_index_accepts_rounded_axes(n_lat, n_lon):
+    """Steps that are not a multiple of 0.01 stay regular after geodata.rounded_axis."""
+    latitude, longitude = synthetic.grid_axes(n_lat, n_lon)
+    grid = GridIndex(geodata.rounded_axis(geodata.longitude_180(longitude)), geodata.rounded_axis(latitude))
+    i, j = grid.nearest(np.array([2.35]), np.array([48.85]))
+    assert abs(grid.latitude[i[0]] - 48.85) <= abs(grid.lat_step) / 2 + 0.01
+    assert abs(grid.longitude[j[0]] - 2.35) <= abs(grid.lon_step) / 2 + 0.01
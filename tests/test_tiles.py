@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import crop_geojson
+import geodata
+import tiles
+from catalog import Catalog
+from benchmarks import synthetic
+
+
+RUN = datetime(2025, 5, 10)
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    # NOTE: Coarser than CAMS so a cell often falls near tile edges
+    return synthetic.write_dataset(tmp_path_factory.mktemp("tiles"), 105, 175, 3, 105 * 175)
+
+
+@pytest.fixture(autouse=True)
+def cold_caches(data_dir, monkeypatch):
+    monkeypatch.chdir(data_dir)
+    monkeypatch.setattr(geodata, "catalog", Catalog(str(data_dir / "data/netcdf")))
+    geodata.close_datasets()
+    geodata.slice_cache.clear()
+    tiles.tile_cache.clear()
+    yield
+    geodata.close_datasets()
+
+
+LIMITS = [
+    {"north": 54, "south": 44, "west": -4, "east": 8},
+    {"north": 53, "south": 45, "west": -2, "east": 10},
+    {"north": 71, "south": 31, "west": -24, "east": 44}
+]
+
+
+def test_regions_match_direct_reads():
+    """Cold and partly cached regions equal one crop of the whole region."""
+    for limits in LIMITS:
+        region = tiles.forecast_region("PM10", RUN, [0, 1, 2], limits)
+        direct = geodata.query_forecast(geodata.ForecastMultiQuery("PM10", RUN, [0, 1, 2], None, limits), as_array=True)
+        assert np.array_equal(region.values, direct.values)
+        assert np.array_equal(region["lat"].values, direct["lat"].values)
+        assert np.array_equal(region["lon"].values, direct["lon"].values)
+        assert tiles.geojson_region(limits) == crop_geojson.crop_geojson(limits)
+
+
+def test_cold_region_reads_once(monkeypatch):
+    reads = []
+    query_forecast = geodata.query_forecast
+    monkeypatch.setattr(geodata, "query_forecast", lambda query, **kwargs: reads.append(query) or query_forecast(query, **kwargs))
+    tiles.forecast_region("PM10", RUN, [0], LIMITS[0])
+    assert len(reads) == 1
+    tiles.forecast_region("PM10", RUN, [0], LIMITS[0])
+    assert len(reads) == 1
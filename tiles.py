@@ -0,0 +1,154 @@
+"""Europe partitioned into fixed TILE_DEGREES lon/lat tiles. GeoJSON features and forecast grid slices are
+cached per tile, so the map of any region is assembled from cached tiles instead of cropping the Europe
+GeoJSON and NetCDF again. Regions sharing tiles, eg. neighbouring cities, share the cached work.
+Tiles are half-open, [south, north) x [west, east), so every feature and grid cell belongs to exactly one."""
+import os
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+import geodata
+import metrics
+import crop_geojson
+from cache import LRUCache
+from geodata import CompactFrame, ForecastMultiQuery, GeoJSON, GeoJSONlimits
+
+
+TILE_DEGREES = 2.0
+EDGE = 1e-6 # Shifts the strict crop limits so tiles include their south and west edges
+
+
+@dataclass
+class TileFeatures:
+    positions: np.ndarray # Positions of the features in the GeoJSON file
+    features: list[dict]
+    nbytes: int # Bytes of the features in the file, a proxy for their parsed size
+
+
+Tile = tuple[int, int] # (row, column), row 0 starts at the equator and column 0 at Greenwich
+
+tile_cache = LRUCache(max_bytes=int(os.environ.get("TILE_CACHE_MB", 256)) * 2**20, sizeof=lambda value: value.nbytes if value is not None else 0)
+metrics.register_collector(lambda: metrics.cache_gauges("tiles", tile_cache.stats()))
+_missing = object()
+
+
+def tiles_for(limits:GeoJSONlimits) -> list[Tile]:
+    """Tiles overlapping limits, north to south and west to east."""
+    rows = range(math.floor(limits["north"] / TILE_DEGREES), math.floor(limits["south"] / TILE_DEGREES) - 1, -1)
+    columns = range(math.floor(limits["west"] / TILE_DEGREES), math.floor(limits["east"] / TILE_DEGREES) + 1)
+    return [(row, column) for row in rows for column in columns]
+
+
+def tile_limits(tile:Tile) -> GeoJSONlimits:
+    """Strict crop limits selecting [south, north) x [west, east) of tile."""
+    row, column = tile
+    return {
+        "north": (row + 1) * TILE_DEGREES - EDGE,
+        "south": row * TILE_DEGREES - EDGE,
+        "west": column * TILE_DEGREES - EDGE,
+        "east": (column + 1) * TILE_DEGREES - EDGE
+    }
+
+
+def tiles_bbox(tiles:list[Tile]) -> GeoJSONlimits:
+    """Strict crop limits of the smallest box covering tiles."""
+    parts = [tile_limits(tile) for tile in tiles]
+    return {
+        "north": max(part["north"] for part in parts),
+        "south": min(part["south"] for part in parts),
+        "west": min(part["west"] for part in parts),
+        "east": max(part["east"] for part in parts)
+    }
+
+
+def inside(limits:GeoJSONlimits, lon:np.ndarray, lat:np.ndarray) -> np.ndarray:
+    return (lon > limits["west"]) & (lon < limits["east"]) & (lat < limits["north"]) & (lat > limits["south"])
+
+
+def tile_features(tiles:list[Tile], geojson_path:Path|str=crop_geojson.EUROPE_GEOJSON_PATH) -> list[TileFeatures]:
+    """GeoJSON features whose centroid lies in each tile. Tiles missing from tile_cache are read together,
+    one index query and one pass over the file for their bounding box, then split by centroid."""
+    index = crop_geojson.load_geojson_index(geojson_path)
+    keys = {tile: ("geojson", str(geojson_path), index.source_mtime, tile) for tile in tiles}
+    parts = {tile: tile_cache.get(key) for tile, key in keys.items()}
+    missing = [tile for tile, part in parts.items() if part is None]
+    if missing:
+        positions = index.query(tiles_bbox(missing))
+        features = list(crop_geojson.read_features(geojson_path, index, positions))
+        lon, lat = index.centroids[positions, 0], index.centroids[positions, 1]
+        for tile in missing:
+            selected = np.flatnonzero(inside(tile_limits(tile), lon, lat))
+            parts[tile] = TileFeatures(positions[selected], [features[k] for k in selected.tolist()], int(index.lengths[positions[selected]].sum()))
+            tile_cache.put(keys[tile], parts[tile])
+    return [parts[tile] for tile in tiles]
+
+
+@metrics.timed("tiles.geojson")
+def geojson_region(limits:GeoJSONlimits, geojson_path:Path|str=crop_geojson.EUROPE_GEOJSON_PATH) -> GeoJSON:
+    """crop_geojson(limits) assembled from cached tiles, with the features in the same file order."""
+    parts = tile_features(tiles_for(limits), geojson_path)
+    positions = np.concatenate([part.positions for part in parts])
+    features = [feature for part in parts for feature in part.features]
+    ordered = [features[k] for k in np.argsort(positions, kind="stable").tolist()]
+    return crop_geojson.crop_geojson(limits, {"type": "FeatureCollection", "features": ordered})
+
+
+def split_tile(block:Optional[CompactFrame], tile:Tile) -> Optional[CompactFrame]:
+    """Grid cells of tile cut from a block read over several tiles, None when the block has none.
+    NOTE: Copies, a view would keep the whole block alive while tile_cache charges only the tile"""
+    if block is None:
+        return None
+    try:
+        lat_slice, lon_slice = geodata.crop_slices(block.longitude, block.latitude, tile_limits(tile))
+    except ValueError: # No grid cells within the tile
+        return None
+    return CompactFrame(block.values[:, lat_slice, lon_slice].copy(), block.longitude[lon_slice].copy(), block.latitude[lat_slice].copy(), block.leadtimes, block.variable, block.time)
+
+
+def tile_forecasts(tiles:list[Tile], variable:str, time:datetime, leadtimes:list[int], model:Optional[str]=None) -> list[Optional[CompactFrame]]:
+    """Grid cells of each tile, None where the forecast grid does not reach it. Tiles missing from tile_cache
+    are read together, one query_forecast for their bounding box, then split into tiles."""
+    source = geodata.forecast_source(variable, time, model)
+    mtime = os.stat(source).st_mtime_ns
+    keys = {tile: ("forecast", source, mtime, variable, model, tuple(leadtimes), tile) for tile in tiles}
+    parts = {tile: tile_cache.get(key, _missing) for tile, key in keys.items()}
+    missing = [tile for tile, part in parts.items() if part is _missing]
+    if missing:
+        try:
+            block = geodata.query_forecast(ForecastMultiQuery(variable, time, leadtimes, model, tiles_bbox(missing)), compact=True)
+        except ValueError: # No grid cells within the tiles
+            block = None
+        for tile in missing:
+            parts[tile] = split_tile(block, tile)
+            tile_cache.put(keys[tile], parts[tile])
+    return [parts[tile] for tile in tiles]
+
+
+@metrics.timed("tiles.forecast")
+def forecast_region(variable:str, time:datetime, leadtimes:list[int], limits:GeoJSONlimits, model:Optional[str]=None) -> xr.DataArray:
+    """(leadtime, lat, lon) forecast inside limits assembled from cached tiles, the same array as
+    query_forecast(..., as_array=True) returns for limits."""
+    parts = [part for part in tile_forecasts(tiles_for(limits), variable, time, leadtimes, model) if part is not None]
+    if not parts:
+        raise ValueError(f"No grid cells within limits {limits}")
+    longitude = np.unique(np.concatenate([part.longitude for part in parts]))
+    latitude = np.unique(np.concatenate([part.latitude for part in parts]))[::-1] # NOTE: descending order
+    values = np.full((len(leadtimes), len(latitude), len(longitude)), np.nan, dtype=np.float32)
+    for part in parts:
+        row = len(latitude) - 1 - int(np.searchsorted(latitude[::-1], part.latitude[0]))
+        column = int(np.searchsorted(longitude, part.longitude[0]))
+        values[:, row:row + len(part.latitude), column:column + len(part.longitude)] = part.values
+
+    lat_slice, lon_slice = geodata.crop_slices(longitude, latitude, limits)
+    return xr.DataArray(
+        values[:, lat_slice, lon_slice],
+        dims=("leadtime", "lat", "lon"),
+        coords={"leadtime": leadtimes, "lat": latitude[lat_slice], "lon": longitude[lon_slice]},
+        name=variable,
+        attrs={"time": time}
+    )
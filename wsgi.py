@@ -0,0 +1,27 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py wsgi:server
+
+With preload_app the master imports this module once and forks the workers, which then share the forecast arrays
+and GeoJSON pages copy-on-write instead of loading their own copies. gunicorn preloads before it binds the port, so
+the master only takes the snapshot fast path: importing the data modules and loading the snapshot of the latest
+run, a second or two. Without a snapshot, eg. on the first start after a new run or a deploy, the port is bound
+right away and each worker builds the state in the background (see post_fork in gunicorn.conf.py). That costs one
+copy of the state and one build per worker until the next refresh, in exchange for a port that is not held up
+for the whole build."""
+import gc
+
+import geodata
+import main
+
+
+main.preload()
+
+# NOTE: HDF5 handles must not cross a fork. Workers reopen files on demand, decoded slices stay cached.
+geodata.close_datasets()
+
+# Move everything loaded so far out of the garbage collector's reach. A collection in a worker would otherwise
+# write to every inherited object header and copy the shared pages into each worker.
+gc.collect()
+gc.freeze()
+
+app = main.app
+server = app.server